@@ -0,0 +1,165 @@
+"""
+This module aggregates decoded Parsivel2 records over aligned time intervals
+
+An ``Accumulator`` keeps running sums of the 32x32 spectra and running
+mean/min/max statistics of the numeric scalar fields in fixed-size NumPy
+buffers; quality flags are combined with a bitwise OR. Records are binned on
+interval boundaries aligned to the epoch (e.g. 00, 05, 10 ... minutes past
+the hour for 5 minute intervals) and one aggregated record is emitted per
+interval.
+"""
+
+import numpy as np
+import numpy.lib.recfunctions as rfn
+
+
+def aggregate_dtype(dtype):
+    """
+    Layout of the aggregated record for a decoded record layout
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        Record layout from ``TelegramDecoder.dtype``
+
+    Output
+    ------
+    dtype : numpy.dtype
+        Interval start ``time``, record ``count``, the mean, min and max of
+        each numeric scalar field, the combined ``qc_flags`` and the summed
+        spectra, if present
+    """
+    fields = [("time", "datetime64[ms]"), ("count", np.int32)]
+    for name in scalar_fields(dtype):
+        fields.extend([(name, np.float32),
+                       (name + "_min", np.float32),
+                       (name + "_max", np.float32)])
+    if "qc_flags" in dtype.names:
+        fields.append(("qc_flags", np.uint16))
+    for name in spectrum_fields(dtype):
+        fields.append((name, np.int32, dtype[name].shape))
+    return np.dtype(fields)
+
+
+def scalar_fields(dtype):
+    """Names of the numeric scalar fields of a record layout"""
+    return [name for name in dtype.names
+            if name not in ("time", "qc_flags")
+            and dtype[name].shape == ()
+            and dtype[name].kind in "iuf"]
+
+
+def spectrum_fields(dtype):
+    """Names of the diameter x velocity count fields of a record layout"""
+    return [name for name in dtype.names if len(dtype[name].shape) == 2]
+
+
+class Accumulator:
+    """
+    Running aggregation of records over aligned intervals
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        Record layout from ``TelegramDecoder.dtype``
+    period : int
+        Length of the aggregation interval in seconds
+    """
+
+    def __init__(self, dtype, period):
+        self.period = int(period)
+        self.dtype = aggregate_dtype(dtype)
+        self._scalars = scalar_fields(dtype)
+        self._flags = "qc_flags" in dtype.names
+        nscalar = len(self._scalars)
+        self._sum = np.zeros(nscalar, dtype=np.float64)
+        self._min = np.full(nscalar, np.inf)
+        self._max = np.full(nscalar, -np.inf)
+        self._qc_flags = 0
+        self._spectra = {name: np.zeros(dtype[name].shape, dtype=np.int32)
+                         for name in spectrum_fields(dtype)}
+        self._count = 0
+        self._bin = None
+        self._period_ms = np.int64(self.period * 1000)
+
+    def add(self, record):
+        """
+        Add a record, emitting the previous interval once it has ended
+
+        Parameters
+        ----------
+        record : numpy.void
+            Decoded record from ``TelegramDecoder.decode``
+
+        Output
+        ------
+        aggregate : numpy.void or None
+            Aggregated record for the interval that just ended, if any
+        """
+        time_ms = record["time"].astype("datetime64[ms]").astype(np.int64)
+        interval = time_ms // self._period_ms
+        emitted = None
+        if self._bin is not None and interval != self._bin:
+            emitted = self.emit()
+        self._bin = interval
+
+        values = rfn.structured_to_unstructured(np.asarray(record)[self._scalars],
+                                                dtype=np.float64)
+        self._sum += values
+        np.minimum(self._min, values, out=self._min)
+        np.maximum(self._max, values, out=self._max)
+        if self._flags:
+            self._qc_flags |= int(record["qc_flags"])
+        for name, counts in self._spectra.items():
+            counts += record[name]
+        self._count += 1
+        return emitted
+
+    def poll(self, now):
+        """
+        Emit the current interval if it has ended without a newer record
+
+        Parameters
+        ----------
+        now : numpy.datetime64
+            Current time
+
+        Output
+        ------
+        aggregate : numpy.void or None
+            Aggregated record for the interval, if it has ended
+        """
+        if self._bin is None:
+            return None
+        now_ms = np.datetime64(now, "ms").astype(np.int64)
+        if now_ms // self._period_ms > self._bin:
+            return self.emit()
+        return None
+
+    def emit(self):
+        """Return the aggregate of the current interval and start a new one"""
+        if self._bin is None or not self._count:
+            return None
+        out = np.zeros((), dtype=self.dtype)
+        out["time"] = np.datetime64(int(self._bin * self._period_ms), "ms")
+        out["count"] = self._count
+        for i, name in enumerate(self._scalars):
+            out[name] = self._sum[i] / self._count
+            out[name + "_min"] = self._min[i]
+            out[name + "_max"] = self._max[i]
+        if self._flags:
+            out["qc_flags"] = self._qc_flags
+        for name, counts in self._spectra.items():
+            out[name] = counts
+        self._reset()
+        return out[()]
+
+    def _reset(self):
+        self._sum[:] = 0.0
+        self._min[:] = np.inf
+        self._max[:] = -np.inf
+        self._qc_flags = 0
+        for counts in self._spectra.values():
+            counts[...] = 0
+        self._count = 0
+        self._bin = None
@@ -6,193 +6,83 @@ To display currently available serial ports:
 python -m serial.tools.list_ports
 """
 
+import os
+import re
 import time
 import argparse
-import csv
-import threading
+import asyncio
+
+from functools import partial
 
 from datetime import datetime, timezone
 from pathlib import Path
 
-import serial
+import numpy as np
 
-from waggle.plugin import Plugin, get_timestamp
+from metrics import Metrics, process_uptime
+from precipitation import PrecipitationState
+from products import PRODUCTS, compute_products
+from publisher import Publisher
+from scheduler import RotationScheduler, interval_start
+from qc import FLAG_MEANINGS, QualityControl, qc_fields
+from serial_ports import Backoff, find_port, load_identity, port_identity, save_identity
+from serial_reader import TelegramReader
+from spectrum_codec import ENCODING as SPECTRUM_ENCODING, encode_spectrum
+from telegram import TelegramError, compile_decoder, define_telegram, telegram_codes
+from uploader import UploadQueue
+from writers import (COMPRESSION, FORMATS, PART_SUFFIX, compress_file, open_writer,
+                     recover_files)
 
-def define_telegram(site):
-    """
-    Fuction to define the telegram for the specific site
-    
-    Parameters
-    ----------
-    site : str
-        Site Identifier to specify instrument configuration
+# Longest a file is kept open past its interval for a telegram still arriving
+STRADDLE_TIMEOUT = 10.0
+# Identities of the USB serial adapters, kept in --outdir across restarts
+PORTS_FILE = ".serial_ports.json"
 
-    Output
-    ------
-    telegram : list (str)
-        Parameter descriptions for the instrument configuration
-    telegram_units : list (str)
-        Parameter units for the instrument configuration
-    publish_list : list (int)
-        Integers of parameters to keep to publish to beehive separately from
-        the csv files.
-    publish_parms : list (str)
-        Short names of parameters to publish to beehive.
-    """
-    if site == "adm" or site == "ADM":
-        # instrument configured for following telegram:
-        #%13;%21;%20;%18;%25;%17;%16;%27;%28;%12;%01;%02;%07;%11;%60;%90;%91;%93
-        telegram = ["Timestamp (UTC)",
-                    "\tSensor Serial Num (%13)",
-                    "\tSensor Date (%21)",
-                    "\tSensor Time (%20)", 
-                    "\tSensor Status (%18)",
-                    "\tError Code (%25)",
-                    "\tPower Supply Voltage (%17)",
-                    "\tSensor Head Heating Current (%16)",
-                    "\tTemperature in the right sensor head (%27)",
-                    "\tTemperature in the left sensor head (%28)",
-                    "\tSensor Heating Temperature (%12)",
-                    "\tRain Intensity (%01)",
-                    "\tRain Amount Accumulated (%02)",
-                    "\tRadar Reflectivity (%07)",
-                    "\tNumber of Particles Validated (%11)",
-                    "\tNumber of Particles Detected (%60)",
-                    "\tN(d) (%90)",
-                    "\tv(d) (%91)",
-                    "\tRaw Data (%93)"]
-        telegram_units = ["YYYY-MM-DDTHH:MM:SS",
-                          "\t#",
-                          "\tDD.MM.YYYY",
-                          "\thh:mm:ss",
-                          "\t#",
-                          "\t#",
-                          "\tV",
-                          "\tA",
-                          "\tdegC",
-                          "\tdegC",
-                          "\tdegC",
-                          "\tmm/hr",
-                          "\tmm",
-                          "\tdBZ",
-                          "\t#",
-                          "\t#",
-                          "\tlog10(1/m3 mm)",
-                          "\tm/s",
-                          "\t#"]
-        publish_list = [4, 5, 6, 11, 12, 13]
-        publish_parms = ["parsivel.house.status",
-                         "parsivel.house.error",
-                         "parsivel.house.voltage",
-                         "parsivel.rain.intensity",
-                         "parsivel.rain.accum",
-                         "parsivel.radar"]
-    elif site == "atmos" or site == "ATMOS":
-        # instrument configured for following telegram:
-        #%13;%21;%20;%18;%25;%17;%16;%27;%28;%12;%01;%02;%07;%11;%60;%90;%91;%93
-        telegram = ["Timestamp (UTC)",
-                    "\tSensor Serial Num (%13)",
-                    "\tSensor Date (%21)",
-                    "\tSensor Time (%20)", 
-                    "\tSensor Status (%18)",
-                    "\tError Code (%25)",
-                    "\tPower Supply Voltage (%17)",
-                    "\tSensor Head Heating Current (%16)",
-                    "\tTemperature in the right sensor head (%27)",
-                    "\tTemperature in the left sensor head (%28)",
-                    "\tSensor Heating Temperature (%12)",
-                    "\tRain Intensity (%01)",
-                    "\tRain Amount Accumulated (%02)",
-                    "\tRadar Reflectivity (%07)",
-                    "\tNumber of Particles Validated (%11)",
-                    "\tNumber of Particles Detected (%60)",
-                    "\tN(d) (%90)",
-                    "\tv(d) (%91)",
-                    "\tRaw Data (%93)"]
-        telegram_units = ["YYYY-MM-DDTHH:MM:SS",
-                          "\t#",
-                          "\tDD.MM.YYYY",
-                          "\thh:mm:ss",
-                          "\t#",
-                          "\t#",
-                          "\tV",
-                          "\tA",
-                          "\tdegC",
-                          "\tdegC",
-                          "\tdegC",
-                          "\tmm/hr",
-                          "\tmm",
-                          "\tdBZ",
-                          "\t#",
-                          "\t#",
-                          "\tlog10(1/m3 mm)",
-                          "\tm/s",
-                          "\t#"]
-        publish_list = [4, 5, 6, 11, 12, 13]
-        publish_parms = ["parsivel.house.status",
-                         "parsivel.house.error",
-                         "parsivel.house.voltage",
-                         "parsivel.rain.intensity",
-                         "parsivel.rain.accum",
-                         "parsivel.radar"]
-    else:
-        # default telegram from the factory
-        # %13;%01;%02;%03;%07;%08;%34;%12;%10;%11;%18;
-        telegram = ["Timestamp (UTC)",
-                    "\tSensor Serial Number (%13)",
-                    "\tRain Intensity (%01)",
-                    "\tRain Amount Accumulated (%02)",
-                    "\tWeather Code SYNOP (%03)",
-                    "\tRadar Reflectivity (%07)",
-                    "\tMOR Visibilty in Precip (%08)",
-                    "\tKinetic Energy (%34)",
-                    "\tTemperature in the Sensor Housing (%12)",
-                    "\tSignal Amplitude of the laser strip (%10)",
-                    "\tNumber of Particles Detected and Validated (%11)",
-                    "\tSensor Status (%18)"]
-        telegram_units = ["YYYY-MM-DDTHH:MM:SS",
-                          "\t#",
-                          "\tmm/h",
-                          "\tmm",
-                          "\t#",
-                          "\tdBz",
-                          "\tm",
-                          "\tJ/(m^2h)",
-                          "\tdegC",
-                          "\t#",
-                          "\t#",
-                          "\t#"]
-        publish_list = [2, 3, 5, 8, 11]
-        publish_parms = ["parsivel.rain.intensity",
-                         "parsivel.rain.accum",
-                         "parsivel.radar",
-                         "parsivel.house.temp",
-                         "parsivel.house.status"]
-
-    return telegram, telegram_units, publish_list, publish_parms
-
-def list_files(img_dir):
+def list_files(img_dir, ext="csv"):
     """
     Lists all files within a directory and their sizes in bytes.
 
     Parameters:
         img_dir: The path to the directory to list files from within
             the DockerFile image.
+        ext: Extension of the output files to list.
     """
     dir_path = Path(img_dir)
-    saved_files = sorted(list(dir_path.glob("*.csv")))
+    saved_files = sorted(list(dir_path.glob(f"*.{ext}")))
     if saved_files:
         print('updated path/files: ')
         for sfile in saved_files:
             file_size = sfile.stat().st_size
             print(f"{sfile}: {file_size} bytes")
 
-def define_filename(site, outdir):
-    """Function to generate the filename based on the current time"""
+def instrument_name(site, device, sites):
+    """
+    Name of an instrument's output files and cache
+
+    The site itself, unless several devices share the site (e.g. two
+    disdrometers programmed with the ADM telegram), in which case the
+    device name is appended to keep their files apart.
+
+    Parameters
+    ----------
+    site : str
+        Site Identifier of the instrument
+    device : str
+        Serial port the instrument is attached to
+    sites : list (str)
+        Site Identifiers of all instruments
+    """
+    if sites.count(site) < 2:
+        return site
+    return site + "-" + re.sub(r"[^A-Za-z0-9-]", "-", Path(device).name)
+
+def define_filename(site, outdir, ext="csv", start=None):
+    """Function to generate the filename based on the start of the interval it covers"""
+    start = start or datetime.now(timezone.utc)
     nout = (site +
             '.parsivel2.' +
-            datetime.now(timezone.utc).strftime("%Y%m%d.%H%M%S") +
-            '.csv')
+            start.strftime("%Y%m%d.%H%M%S") +
+            '.' + ext)
     # Define the Path to the CSV file
     csv_path = Path(outdir) / nout
     # Ensure the parent directory exists
@@ -200,120 +90,535 @@ def define_filename(site, outdir):
 
     return csv_path
 
-def publish_file(file_path):
-    """Utilizing threading, publish file to Beehive"""
-    def upload_file(file_path):
-        """Call the Waggle Plugin"""
-        with Plugin() as plugin:
-            plugin.upload_file(file_path, timestamp=get_timestamp())
-            print(f"Published {file_path}")
-    # Define threads
-    thread = threading.Thread(target=upload_file, args=(file_path,))
-    thread.start()
-    thread.join()
+def recover_uploads(input_args, uploader):
+    """
+    Queue output files left behind by a previous run for upload
+
+    Interrupted files are completed from their temporary copies, and any
+    complete file that was never handed to the uploader is queued,
+    compressed first if requested.
 
-def main(input_args):
-    """Establish Serial Connection and Write Parsivel Data to file"""
-
-    # Initialize the Serial Connection:
-    with serial.Serial(input_args.device,
-                       input_args.baud_rate,
-                       parity=serial.PARITY_NONE,
-                       stopbits=serial.STOPBITS_ONE,
-                       bytesize=serial.EIGHTBITS,
-                       timeout = 1) as ser:
-        print(f"Serial connection to {input_args.device} is open")
-        # Define the Filename for the initial Output file
-        csv_path = define_filename(input_args.site, input_args.outdir)
-        # Open the file
-        nfile = open(csv_path, mode='w', encoding="ascii", newline='')
-        writer = csv.writer(nfile, delimiter=';')
-        print(f"Initializing file: {nfile.name}")
-        # Write the file header information
+    Parameters
+    ----------
+    input_args : argparse.Namespace
+        Input Argument dictionary
+    uploader : uploader.UploadQueue
+        Background queue the files are handed to
+    """
+    qc = None
+    if input_args.qc:
+        qc = QualityControl(velocity_tolerance=input_args.qc_tolerance)
+    recover_files(input_args.outdir, qc)
+    suffixes = tuple("." + ext + compressed for ext in FORMATS.values()
+                     for compressed in [""] + list(COMPRESSION.values()))
+    for path in sorted(Path(input_args.outdir).glob("*.parsivel2.*")):
+        if not path.name.endswith(suffixes) or uploader.is_pending(path):
+            continue
+        if input_args.compress and not path.name.endswith(tuple(COMPRESSION.values())):
+            path = compress_file(path, input_args.compress)
+        print(f"Queueing orphaned file {path}")
+        uploader.submit(path)
+
+def upload_file(plugin, file_path):
+    """Publish file to Beehive via the Waggle Plugin"""
+    from waggle.plugin import get_timestamp  # pylint: disable=import-outside-toplevel
+    plugin.upload_file(file_path, timestamp=get_timestamp())
+    print(f"Published {file_path}")
+
+class Instrument:
+    """
+    A single Parsivel2 attached to the node
+
+    Each instrument owns its serial connection, telegram decoder, output
+    file and rotation, and is driven by the shared asyncio event loop so
+    several disdrometers can be served from one plugin process.
+
+    Parameters
+    ----------
+    device : str
+        Serial port the instrument is attached to
+    site : str
+        Site Identifier to specify instrument configuration
+    input_args : argparse.Namespace
+        Input Argument dictionary
+    plugin : waggle.plugin.Plugin
+        Plugin session shared by all instruments
+    uploader : uploader.UploadQueue
+        Background queue rotated files are handed to
+    name : str, optional
+        Name of the output files and cache, the site by default, see
+        ``instrument_name``
+    """
+
+    def __init__(self, device, site, input_args, plugin, uploader, name=None):
+        self.device = device
+        self.site = site
+        self.name = name or site
+        # Metadata of every message, telling apart devices sharing a site
+        self.meta = {"sensor" : "parsivel2", "site" : site}
+        if self.name != site:
+            self.meta["instrument"] = self.name
+        self.args = input_args
+        self.uploader = uploader
+        # Define the telegram and the file header information
         ## NOTE - dependent on telegram programmed into the instrument
-        telegram, telegram_units, publish_list, publish_parms = define_telegram(input_args.site)
-        writer.writerow(telegram)
-        writer.writerow(telegram_units)
+        (self.telegram, self.telegram_units,
+         publish_list, publish_parms) = define_telegram(site, input_args.telegram)
+        # Quality control appends its flags and cleaned spectrum to each record
+        self.qc = None
+        extra = ()
+        if input_args.qc:
+            self.qc = QualityControl(velocity_tolerance=input_args.qc_tolerance)
+            extra = qc_fields(telegram_codes(self.telegram))
+        # Compile the decoder for the telegram once, up front
+        self.decoder = compile_decoder(tuple(telegram_codes(self.telegram)), tuple(extra))
+        self.ext = FORMATS[input_args.output]
+        self._publish = []
+        if input_args.publish:
+            self._publish = [(publish_parms[i], self.decoder.names[parm - 1],
+                              self.telegram_units[parm], self.telegram[parm])
+                             for i, parm in enumerate(publish_list)]
+            if self.qc:
+                self._publish.append(("parsivel.qc.flags", "qc_flags", "bitmask",
+                                      "Quality control flags: " + ", ".join(FLAG_MEANINGS)))
+        # Sparse encoded drop spectrum, see spectrum_codec
+        if input_args.publish_spectrum and "raw_spectrum" in self.decoder.names:
+            self._publish.append(("parsivel.spectrum", "raw_spectrum", "#",
+                                  "Raw drop spectrum, 32 diameter x 32 velocity classes"))
+        # Per record publishing, unless only aggregates are wanted
+        self.publisher, self.products = None, None
+        if not input_args.aggregate_only:
+            self.publisher, self.products = self._publishers(plugin, self.decoder.dtype)
+        # Aggregation over aligned intervals, each with its own publishers
+        self.aggregators = []
+        if input_args.aggregate:
+            # Optional stages are imported only when enabled, keeping them
+            # (and numpy.lib.recfunctions, http.server) off the startup path
+            from aggregate import Accumulator  # pylint: disable=import-outside-toplevel
+        for minutes in input_args.aggregate:
+            accumulator = Accumulator(self.decoder.dtype, minutes * 60)
+            self.aggregators.append(
+                (accumulator,) + self._publishers(plugin, accumulator.dtype, f".{minutes}min"))
+        # Recent records kept for other plugins on the node
+        self.cache = None
+        if input_args.cache_hours > 0:
+            from ringbuffer import RingBuffer  # pylint: disable=import-outside-toplevel
+            capacity = int(input_args.cache_hours * 3600 / input_args.interval)
+            cache_path = None
+            if input_args.cache_dir:
+                Path(input_args.cache_dir).mkdir(parents=True, exist_ok=True)
+                cache_path = Path(input_args.cache_dir) / f"{self.name}.parsivel2.cache.npy"
+            self.cache = RingBuffer(self.decoder.dtype, capacity, cache_path)
+        self.ser = None
+        self.reader = TelegramReader(None)
+        self.writer = None
+        # Previous file, kept open for a telegram that started before its end
+        self._file_start = None
+        self._previous = None
+        self._previous_timer = None
+        # Adaptive mode writes only the scalar fields in dry weather
+        self.precip = None
+        if input_args.adaptive:
+            self.precip = PrecipitationState(
+                self.decoder.names, input_args.rain_threshold, input_args.rain_particles,
+                input_args.dry_after * 60 // input_args.interval)
+        self._dry_fields = [name for name in self.decoder.dtype.names
+                            if name != "time" and self.decoder.dtype[name].shape == ()]
+        self._tasks = set()
+        self.scheduler = RotationScheduler(self._period(), self._on_boundary)
+        # Acquisition health and hot-path timings, see collect_metrics
+        self.metrics = Metrics()
+        self._connected = False
+        self._first_record = False
+        # Reconnection to a lost or renumbered serial port, also one
+        # renumbered before the plugin (re)started
+        self.backoff = Backoff(input_args.reconnect_min, input_args.reconnect_max)
+        self._configured = device
+        self._ports_file = Path(input_args.outdir) / PORTS_FILE
+        self._identity = load_identity(self._ports_file, device)
+        self._retry_at = 0.0
+
+    def _publishers(self, plugin, dtype, suffix=""):
+        """
+        Create the parameter and DSD product publishers for a record layout
+
+        Parameters
+        ----------
+        plugin : waggle.plugin.Plugin
+            Plugin session shared by all instruments
+        dtype : numpy.dtype
+            Layout of the records that will be published
+        suffix : str
+            Appended to the published parameter names, e.g. ".5min"
+
+        Output
+        ------
+        publisher : publisher.Publisher or None
+            Publisher of the selected telegram parameters, if enabled
+        products : publisher.Publisher or None
+            Publisher of the derived DSD products, if enabled and the
+            records carry a drop spectrum
+        """
+        publisher, products = None, None
+        params = [param for param in self._publish if param[1] in dtype.names]
+        if params:
+            meta = [dict(self.meta, units=units, description=description)
+                    for _, _, units, description in params]
+            for (_, field, _, _), param_meta in zip(params, meta):
+                if field == "raw_spectrum":
+                    param_meta.update(encoding=SPECTRUM_ENCODING, shape="32x32")
+            publisher = Publisher(plugin,
+                                  [name + suffix for name, _, _, _ in params],
+                                  [field for _, field, _, _ in params],
+                                  meta,
+                                  batch_size=self.args.publish_batch,
+                                  encoders={"raw_spectrum": encode_spectrum})
+        if self.args.products and ("raw_spectrum" in dtype.names or "nd" in dtype.names):
+            products = Publisher(plugin,
+                                 [f"parsivel.dsd.{name}{suffix}" for name in PRODUCTS],
+                                 list(PRODUCTS),
+                                 [dict(self.meta, units=units, description=description)
+                                  for units, description in PRODUCTS.values()],
+                                 batch_size=self.args.publish_batch)
+        return publisher, products
+
+    def _publish_aggregate(self, aggregate, publisher, products):
+        """Publish an aggregated record and the products of its spectrum"""
+        if aggregate is None:
+            return
+        if publisher:
+            publisher.add(aggregate)
+        if products:
+            products.add(compute_products(aggregate,
+                                          self.args.interval * int(aggregate["count"])))
+
+    def _period(self):
+        """Rotation interval in seconds for the current mode"""
+        if self.precip and not self.precip.raining:
+            return self.args.dry_freq * 60
+        return self.args.freq * 60
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until done"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def open_file(self, start):
+        """
+        Define a new filename and open the output file
+
+        Parameters
+        ----------
+        start : float
+            Start of the interval the file covers, seconds since the epoch
+        """
+        out_path = define_filename(self.name, self.args.outdir, self.ext,
+                                   datetime.fromtimestamp(start, timezone.utc))
+        # Mode changes can open a second file within the same second
+        stem, count = out_path.stem, 0
+        while out_path.exists() or Path(str(out_path) + PART_SUFFIX).exists():
+            count += 1
+            out_path = out_path.with_name(f"{stem}.{count}{out_path.suffix}")
+        fields = None
+        if self.precip and not self.precip.raining:
+            fields = self._dry_fields
+        self._file_start = start
+        self.writer = open_writer(self.args.output, out_path,
+                                  self.telegram, self.telegram_units, self.decoder, fields,
+                                  self.args.journal_records)
+        print(f"Initializing file: {self.writer.name}")
+
+    def _on_boundary(self, boundary):
+        """Rotate the file at an interval boundary, called by the scheduler"""
+        self.metrics.observe("rotation_lag", self.scheduler.lag)
+        self.rotate(boundary)
+
+    def rotate(self, start):
+        """Open a new file and queue the current one for closing and upload"""
+        closed = self.writer
+        self.open_file(start)
+        # A telegram whose first byte arrived before the boundary belongs to
+        # the closed file, keep it open until the telegram is complete
+        pending = self.reader.pending_since
+        if pending is not None and pending < start and self._previous is None:
+            self._previous = closed
+            self._previous_timer = asyncio.get_running_loop().call_later(
+                STRADDLE_TIMEOUT, self._release_previous)
+            return
+        self._spawn(self._retire(closed))
+
+    def _writer_for(self, arrival):
+        """Writer of the file covering a telegram's arrival time"""
+        if self._previous is not None and arrival < self._file_start:
+            return self._previous
+        return self.writer
+
+    def _release_previous(self):
+        """Retire the file kept open for a telegram straddling its end"""
+        if self._previous is None:
+            return
+        closed, self._previous = self._previous, None
+        self._previous_timer.cancel()
+        self._spawn(self._retire(closed))
+
+    async def _retire(self, closed):
+        """Close a rotated file and queue it for upload"""
+        # Closing may write a whole file (NetCDF), keep it off the event loop
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, closed.close)
+        self.metrics.observe("close_latency", time.perf_counter() - start)
+        path = Path(closed.name)
+        if self.args.compress:
+            path = await loop.run_in_executor(None, compress_file, path, self.args.compress)
+        file_bytes = path.stat().st_size
+        self.metrics.gauge("file_bytes", file_bytes)
+        self.metrics.incr("files")
+        self.metrics.incr("bytes_written", file_bytes)
+        # if desired, check on current files and file sizes
+        if self.args.verbose:
+            list_files(self.args.outdir, self.ext)
+            print(f"Frame statistics ({self.device}): {self.reader.stats()}")
+            if self.publisher:
+                print(f"Publish statistics ({self.device}): {self.publisher.stats()}")
+        # Queue the file for upload via Waggle
+        self.uploader.submit(path)
+        if self.cache is not None:
+            self.cache.flush()
+
+    def connect(self):
+        """Open the serial port and register it with the event loop"""
+        # pyserial is imported on first use to keep plugin startup fast
+        import serial  # pylint: disable=import-outside-toplevel
+        self.ser = serial.Serial(self.device,
+                                 self.args.baud_rate,
+                                 parity=serial.PARITY_NONE,
+                                 stopbits=serial.STOPBITS_ONE,
+                                 bytesize=serial.EIGHTBITS,
+                                 timeout=0)
+        self.reader.ser = self.ser
+        asyncio.get_running_loop().add_reader(self.ser.fileno(), self._on_readable)
+        if self._connected:
+            self.metrics.incr("reconnects")
+        else:
+            self.metrics.gauge("ready_seconds", process_uptime())
+        self._connected = True
+        self.backoff.reset()
+        # Remember the adapter so it can be found again if renumbered
+        identity = port_identity(self.device)
+        if identity and identity != self._identity:
+            self._identity = identity
+            try:
+                save_identity(self._ports_file, self._configured, identity)
+            except OSError as err:
+                print(f"Could not save the identity of {self.device}: {err}")
+        print(f"Serial connection to {self.device} is open")
+
+    def _reconnect(self, loop):
+        """Try to reopen the serial port, following the adapter if it was renumbered"""
+        device = find_port(self._identity) if self._identity else None
+        if device and device != os.path.realpath(self.device):
+            print(f"Serial port {self.device} is now {device}")
+            self.metrics.incr("port_changes")
+            self.device = device
+        try:
+            self.connect()
+        except OSError as err:
+            # serial.SerialException is an OSError
+            self.metrics.incr("connect_failures")
+            print(f"No Connection with serial port {self.device}: {err}")
+            self._retry_at = loop.time() + self.backoff.next()
+
+    def disconnect(self):
+        """Unregister and close the serial port"""
+        if self.ser is not None:
+            asyncio.get_running_loop().remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.ser = None
+            print(f"Disconnecting from serial port {self.device}")
+
+    def _on_readable(self):
+        """Drain the serial port whenever bytes are available"""
+        try:
+            frames = list(self.reader.read())
+        except OSError:
+            self.metrics.incr("serial_errors")
+            self.disconnect()
+            return
+        for frame, arrival in frames:
+            self.handle(frame, arrival)
+
+    def handle(self, frame, arrival=None):
+        """
+        Decode, write and publish a complete telegram
+
+        Parameters
+        ----------
+        frame : bytes
+            Telegram without its terminator
+        arrival : float, optional
+            Time its first byte was received, seconds since the epoch; the
+            record time, now if not given
+        """
+        if self.args.verbose:
+            print(datetime.now(timezone.utc).strftime('%Y%m%d.%H%M%S'))
+            print("\n")
+            print(frame)
+        # Decode the telegram into a typed record, timed by its arrival
+        arrival = time.time() if arrival is None else arrival
+        start = time.perf_counter()
+        line = frame.decode('utf-8', errors='replace').strip()
+        try:
+            record = self.decoder.decode(line,
+                                         timestamp=np.datetime64(round(arrival * 1000), "ms"))
+        except TelegramError as err:
+            # Keep the raw telegram in the file, skipping only the typed stages
+            self.metrics.incr("malformed")
+            print(f"Could not decode telegram from {self.device}: {err}")
+            writer = self._writer_for(arrival)
+            writer.write_raw(np.datetime64(round(arrival * 1000), "ms"), line)
+            if writer is self._previous:
+                self._release_previous()
+            return
+        parsed = time.perf_counter()
+        self.metrics.observe("parse_latency", parsed - start)
+        if not self._first_record:
+            self._first_record = True
+            uptime = process_uptime()
+            self.metrics.gauge("first_record_seconds", uptime)
+            print(f"First record from {self.device} {uptime:.2f} s after start")
+        if self.qc:
+            self.qc.apply(record)
+        if self.precip and self.precip.update(record):
+            # Start a new file so every file holds a single mode
+            print(f"Switching {self.device} to {self.precip.mode} mode")
+            self.metrics.incr("mode_changes")
+            closed = self.writer
+            self.open_file(arrival)
+            self._spawn(self._retire(closed))
+            self.scheduler.set_period(self._period())
+        writer = self._writer_for(arrival)
+        writer.write(record, line)
+        if writer is self._previous:
+            self._release_previous()
+        self.metrics.observe("write_latency", time.perf_counter() - parsed)
+        self.metrics.incr("records")
+        if self.cache is not None:
+            self.cache.add(record)
+        # If select parameter publishing is desired, upload via Waggle
+        if self.publisher:
+            self.publisher.add(record)
+        # Derive and publish the DSD products from the spectrum
+        if self.products:
+            self.products.add(compute_products(record, self.args.interval))
+        # Accumulate into the aggregation intervals
+        for accumulator, publisher, products in self.aggregators:
+            self._publish_aggregate(accumulator.add(record), publisher, products)
+
+    async def run(self):
+        """Keep the instrument connected and rotate its files"""
+        loop = asyncio.get_running_loop()
+        self.open_file(interval_start(time.time(), self._period()))
+        self.scheduler.start()
         try:
-            last_timestamp = time.gmtime()  # Keep track of the last time we checked
             while True:
-                # Check current time, if past the defined temporal frequency,
-                # generate new file
-                current_timestamp = time.gmtime()
-                if (current_timestamp.tm_min % input_args.freq == 0
-                        and current_timestamp.tm_min != last_timestamp.tm_min):
-                    # Close the current file and create a new one
-                    nfile.close()
-                    # if desired, check on current files and file sizes
-                    if input_args.verbose:
-                        # check on the files
-                        list_files(input_args.outdir)
-                   # Upload file via Waggle
-                    publish_file(nfile.name)
-                    # Define a new filename
-                    csv_path = define_filename(input_args.site, input_args.outdir)
-                    # Open the new file
-                    nfile = open(csv_path, mode='w', encoding="ascii", newline='')
-                    writer = csv.writer(nfile, delimiter=';')
-                    print(f"Initializing new file: {nfile.name}")
-                    # Write the file header information
-                    writer.writerow(telegram)
-                    writer.writerow(telegram_units)
-                    # Update the last checked time
-                    last_timestamp = current_timestamp
                 # Check the serial connection. If not defined, re-establish.
-                try:
-                    if ser is None:
-                        ser = serial.Serial(input_args.device,
-					                        input_args.baud_rate,
-					                        parity=serial.PARITY_NONE,
-					                        stopbits=serial.STOPBITS_ONE,
-					                        bytesize=serial.EIGHTBITS,
-					                        timeout = 1)
-                        print(f"Reconnecting Serial Connection with {input_args.device}")
-                    # Read data from the instrument
-                    data = ser.readlines()
-                    if input_args.verbose:
-                        print(datetime.now(timezone.utc).strftime('%Y%m%d.%H%M%S'))
-                        print("\n")
-                        print(data)
-                    if data:
-                        # Assemble the output list
-                        data_out = [datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')]
-                        data_out.extend(data[0].decode('utf-8').strip().split(';'))
-                        writer.writerow(data_out)
-                        nfile.flush()
-                        # If select parameter publishing is desired, upload via Waggle
-                        if input_args.publish:
-                            print("Publishing Select Parameters to Beehive")
-                            # Publish to the node
-                            with Plugin() as plugin:
-                                i = 0
-                                for parm in publish_list:
-                                    plugin.publish(publish_parms[i],
-                                                   value=data_out[parm],
-                                                   meta={"units" : telegram_units[parm],
-                                                         "sensor" : "parsivel2",
-                                                         "description" : telegram[parm],
-                                                   },
-                                                   scope="node",
-                                                   timestamp=get_timestamp()
-                                    )
-                                    i += 1
-
-                except serial.SerialException:
-                    if not ser is None:
-                        ser.close()
-                        ser = None
-                        print(f"Disconnecting from serial port {input_args.device}")
-                    print(f"No Connection with serial port {input_args.device}")
-                    time.sleep(2)
+                wait = 1.0
+                if self.ser is None:
+                    if loop.time() >= self._retry_at:
+                        self._reconnect(loop)
+                    if self.ser is None:
+                        wait = min(wait, max(0.0, self._retry_at - loop.time()))
+                await asyncio.sleep(wait)
+                # Emit aggregates for intervals that ended without new records
+                now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "ms")
+                for accumulator, publisher, products in self.aggregators:
+                    self._publish_aggregate(accumulator.poll(now), publisher, products)
+        finally:
+            self.scheduler.stop()
+            self.disconnect()
+            self.writer.close()
+            if self._previous is not None:
+                self._previous_timer.cancel()
+                self._previous.close()
+            if self.cache is not None:
+                self.cache.flush()
+            publishers = [self.publisher, self.products]
+            for _, publisher, products in self.aggregators:
+                publishers.extend([publisher, products])
+            for publisher in publishers:
+                if publisher:
+                    publisher.flush()
+                    print(f"Publish statistics ({self.device}): {publisher.stats()}")
+
+    def collect_metrics(self):
+        """Refresh the gauges kept by the reader and publishers, return the metrics"""
+        for name, value in self.reader.stats().items():
+            self.metrics.gauge(f"frames_{name}" if name != "frames" else name, value)
+        if self.precip:
+            self.metrics.gauge("raining", int(self.precip.raining))
+        if self.publisher:
+            self.metrics.gauge("published", self.publisher.published)
+            self.metrics.gauge("publish_failures", self.publisher.failures)
+            self.metrics.histograms["publish_latency"] = self.publisher.latency
+        return self.metrics
+
+async def report_metrics(plugin, instruments, uploader, interval):
+    """Publish the metrics of every instrument and the uploader periodically"""
+    uploads = Metrics()
+    uploads.histograms["upload_latency"] = uploader.latency
+    while True:
+        await asyncio.sleep(interval)
+        for instrument in instruments:
+            instrument.collect_metrics().publish(plugin, instrument.meta)
+        uploads.gauge("upload_queue_depth", uploader.depth)
+        uploads.gauge("uploaded", uploader.uploaded)
+        uploads.gauge("upload_failures", uploader.failed)
+        uploads.publish(plugin, {"sensor" : "parsivel2"})
+
+async def acquire(instruments, plugin, uploader, input_args):
+    """Drive all instruments concurrently on one event loop"""
+    tasks = [instrument.run() for instrument in instruments]
+    if input_args.metrics_interval > 0:
+        tasks.append(report_metrics(plugin, instruments, uploader,
+                                    input_args.metrics_interval))
+    await asyncio.gather(*tasks)
+
+def main(input_args):
+    """Establish Serial Connections and Write Parsivel Data to file"""
+
+    # Imported here so --help and argument errors do not wait on pywaggle
+    from waggle.plugin import Plugin  # pylint: disable=import-outside-toplevel
+
+    # A single plugin session is shared by uploads and publishes
+    with Plugin() as plugin:
+        # Start the background uploader, resubmitting uploads left from a restart
+        uploader = UploadQueue(partial(upload_file, plugin),
+                               Path(input_args.outdir) / ".upload_spool",
+                               workers=input_args.upload_workers)
+        recover_uploads(input_args, uploader)
+        if input_args.publish:
+            print("Publishing Select Parameters to Beehive")
+        instruments = [Instrument(device, site, input_args, plugin, uploader,
+                                  instrument_name(site, device, input_args.site))
+                       for device, site in zip(input_args.device, input_args.site)]
+        # Serve the recent records to other plugins on the node
+        server = None
+        if input_args.cache_hours > 0 and input_args.cache_port:
+            from ringbuffer import CacheServer  # pylint: disable=import-outside-toplevel
+            server = CacheServer({instrument.name: instrument.cache
+                                  for instrument in instruments},
+                                 input_args.cache_host, input_args.cache_port)
+            server.start()
+        try:
+            asyncio.run(acquire(instruments, plugin, uploader, input_args))
         except KeyboardInterrupt:
-            print(f"Program interrupted, closing serial port {input_args.device}")
+            print(f"Program interrupted, closing serial ports {input_args.device}")
         finally:
-            if ser:
-                ser.close()
-            nfile.close()
+            if server is not None:
+                server.close()
+            uploader.close(timeout=5)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -331,11 +636,75 @@ if __name__ == '__main__':
                         help=("[Boolean|Default False] Enable Publishing " +
                               "of Select Parameters to Beehive")
                         )
+    parser.add_argument("--publish-spectrum",
+                        action="store_true",
+                        dest="publish_spectrum",
+                        help=("Publish the Drop Spectrum of each Record as a Compact " +
+                              "Encoded String (parsivel.spectrum)")
+                        )
+    parser.add_argument("--publish-batch",
+                        type=int,
+                        dest="publish_batch",
+                        default=1,
+                        help="[int] Number of Records to Publish Together"
+                        )
+    parser.add_argument("--products",
+                        action="store_true",
+                        dest="products",
+                        help="Publish DSD Products Derived from the Drop Spectrum"
+                        )
+    parser.add_argument("--interval",
+                        type=int,
+                        dest="interval",
+                        default=60,
+                        help="[int] Sampling Interval Configured on the Instrument (seconds)"
+                        )
+    parser.add_argument("--qc",
+                        action="store_true",
+                        dest="qc",
+                        help=("Flag Records from Sensor Status, Error Code and Housekeeping " +
+                              "and Filter Implausible Drops from the Spectrum")
+                        )
+    parser.add_argument("--qc-tolerance",
+                        type=float,
+                        dest="qc_tolerance",
+                        default=0.5,
+                        help=("[float] Allowed Relative Departure from Terminal Velocity " +
+                              "for Drops Kept by the Spectrum Filter")
+                        )
+    parser.add_argument("--aggregate",
+                        type=int,
+                        nargs="*",
+                        dest="aggregate",
+                        default=[],
+                        help=("[int] Intervals (minutes) to Aggregate Records and " +
+                              "Publish Over, e.g. --aggregate 1 5 15")
+                        )
+    parser.add_argument("--aggregate-only",
+                        action="store_true",
+                        dest="aggregate_only",
+                        help="Only Publish Aggregated Values, not Every Record"
+                        )
     parser.add_argument("--device",
                         type=str,
+                        nargs="+",
                         dest='device',
-                        default="/dev/ttyUSB1",
-                        help="[str] Specific Serial Port for Device Communication"
+                        default=["/dev/ttyUSB1"],
+                        help=("[str] Specific Serial Port(s) for Device Communication, " +
+                              "one per instrument, e.g. /dev/serial/by-id/... Paths")
+                        )
+    parser.add_argument("--reconnect-min",
+                        type=float,
+                        dest="reconnect_min",
+                        default=0.5,
+                        help="[float] Seconds before Retrying a Lost Serial Connection"
+                        )
+    parser.add_argument("--reconnect-max",
+                        type=float,
+                        dest="reconnect_max",
+                        default=30.0,
+                        help=("[float] Longest Wait between Serial Reconnection Attempts " +
+                              "(seconds), Doubling from --reconnect-min")
                         )
     parser.add_argument("--baudrate",
                         type=int,
@@ -347,7 +716,22 @@ if __name__ == '__main__':
                         type=str,
                         dest='output',
                         default="csv",
-                        help="[str] output file format (csv or )"
+                        choices=sorted(FORMATS),
+                        help="[str] output file format (csv or netcdf)"
+                        )
+    parser.add_argument("--compress",
+                        type=str,
+                        dest="compress",
+                        default=None,
+                        choices=sorted(COMPRESSION),
+                        help="[str] Compress Closed Files before Upload (gzip or zstd)"
+                        )
+    parser.add_argument("--journal-records",
+                        type=int,
+                        dest="journal_records",
+                        default=5,
+                        help=("[int] Records Buffered in Memory before Being Written " +
+                              "to Disk, the Most Lost in a Crash")
                         )
     parser.add_argument("--freq",
                         type=int,
@@ -355,11 +739,89 @@ if __name__ == '__main__':
                         dest="freq",
                         help="[int] Temporal Frequency of File Generation"
                         )
+    parser.add_argument("--adaptive",
+                        action="store_true",
+                        dest="adaptive",
+                        help=("Write only Scalar Fields and Rotate Files every --dry-freq " +
+                              "Minutes while it is not Raining")
+                        )
+    parser.add_argument("--dry-freq",
+                        type=int,
+                        default=60,
+                        dest="dry_freq",
+                        help="[int] Temporal Frequency of File Generation in Dry Weather"
+                        )
+    parser.add_argument("--rain-threshold",
+                        type=float,
+                        default=0.1,
+                        dest="rain_threshold",
+                        help="[float] Rain Intensity (mm/hr) Starting Rain Mode"
+                        )
+    parser.add_argument("--rain-particles",
+                        type=int,
+                        default=10,
+                        dest="rain_particles",
+                        help="[int] Particles per Record Starting Rain Mode"
+                        )
+    parser.add_argument("--dry-after",
+                        type=int,
+                        default=30,
+                        dest="dry_after",
+                        help="[int] Minutes below Half the Thresholds before Dry Mode Resumes"
+                        )
     parser.add_argument("--site",
                         type=str,
-                        default="atmos",
+                        nargs="+",
+                        default=["atmos"],
                         dest="site",
-                        help="[str] Site Identifer for Deployment location"
+                        help=("[str] Site Identifer(s) for Deployment location, " +
+                              "one per device")
+                        )
+    parser.add_argument("--upload-workers",
+                        type=int,
+                        default=1,
+                        dest="upload_workers",
+                        help="[int] Number of Background Threads Uploading Files"
+                        )
+    parser.add_argument("--telegram",
+                        type=str,
+                        dest="telegram",
+                        default=None,
+                        help=("[str] Telegram Configured on the Instrument, e.g. " +
+                              "'%%13;%%01;%%02' or a File Containing it, Overriding the " +
+                              "Site Default")
+                        )
+    parser.add_argument("--cache-hours",
+                        type=float,
+                        default=0,
+                        dest="cache_hours",
+                        help="[float] Hours of Recent Records Kept for Local Queries (0 disables)"
+                        )
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        default=None,
+                        dest="cache_dir",
+                        help="[str] Directory of Memory-Mapped Caches Kept across Restarts"
+                        )
+    parser.add_argument("--cache-host",
+                        type=str,
+                        default="0.0.0.0",
+                        dest="cache_host",
+                        help=("[str] Address the Query Interface Listens on, All Interfaces " +
+                              "by Default so Plugins in other Pods can Reach it")
+                        )
+    parser.add_argument("--cache-port",
+                        type=int,
+                        default=8090,
+                        dest="cache_port",
+                        help="[int] Port of the Local Query Interface (0 disables)"
+                        )
+    parser.add_argument("--metrics-interval",
+                        type=int,
+                        default=0,
+                        dest="metrics_interval",
+                        help=("[int] Seconds between Publishing Plugin Health Metrics as " +
+                              "parsivel.plugin.* (Default 0, Disabled)")
                         )
     parser.add_argument("--outdir",
                         type=str,
@@ -368,5 +830,14 @@ if __name__ == '__main__':
                         help="[str] Directory where to output files to"
                         )
     args = parser.parse_args()
+    if args.telegram and Path(args.telegram).is_file():
+        args.telegram = Path(args.telegram).read_text(encoding="ascii")
+    if args.compress == "zstd":
+        try:
+            import zstandard  # pylint: disable=unused-import
+        except ImportError:
+            parser.error("--compress zstd requires the zstandard package")
+    if len(args.site) != len(args.device):
+        parser.error("--site must be given once per --device")
 
     main(args)
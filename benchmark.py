@@ -0,0 +1,321 @@
+"""
+This module benchmarks the plugin's record pipeline without hardware
+
+Telegrams from ``simulator.Simulator`` are pushed through the same stages
+the plugin runs for every record: framing of the serial byte stream,
+decoding, quality control, writing to each output format (with rotation),
+publishing and DSD products. Publishing goes to a plugin stand-in that
+discards messages, so the numbers reflect the plugin's own cost.
+
+For every output format the benchmark reports records/sec, per-stage
+latency (mean, median and 99th percentile in microseconds), bytes written
+per record and resident memory at the start and end of the run, so long
+runs expose growth. Results can be saved as JSON to compare changes.
+
+Example:
+python benchmark.py --records 20000 --qc --products --json before.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+from products import PRODUCTS, compute_products
+from publisher import Publisher
+from qc import QualityControl, qc_fields
+from serial_reader import TelegramReader
+from simulator import Simulator
+from telegram import compile_decoder, define_telegram, telegram_codes
+from writers import FORMATS, open_writer
+
+STAGES = ["parse", "qc", "write", "publish", "products", "rotate"]
+
+
+class NullPlugin:
+    """Stand-in for ``waggle.plugin.Plugin`` that discards publishes"""
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, name, value, meta=None, scope=None, timestamp=None):
+        self.published += 1
+
+
+def resident_memory():
+    """Current resident set size of the process in MB"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        # Peak rather than current, in kB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def latency_stats(samples):
+    """Mean, median and 99th percentile of nanosecond samples, in microseconds"""
+    if not len(samples):
+        return None
+    micro = np.asarray(samples, dtype=np.float64) / 1e3
+    return {"mean": float(micro.mean()),
+            "p50": float(np.percentile(micro, 50)),
+            "p99": float(np.percentile(micro, 99)),
+            "count": int(micro.size)}
+
+
+def benchmark_framing(lines, chunk_size=4096):
+    """
+    Throughput of assembling telegrams from a chunked byte stream
+
+    Output
+    ------
+    results : dict
+        Frames and MB processed per second
+    """
+    stream = b"".join(lines)
+    reader = TelegramReader(None)
+    start = time.perf_counter()
+    frames = 0
+    for offset in range(0, len(stream), chunk_size):
+        for _ in reader.feed(stream[offset:offset + chunk_size], now=0.0):
+            frames += 1
+    elapsed = time.perf_counter() - start
+    return {"frames": frames,
+            "frames_per_sec": frames / elapsed,
+            "mb_per_sec": len(stream) / 1e6 / elapsed}
+
+
+def benchmark_format(output, lines, site, input_args, outdir):
+    """
+    Run the per-record pipeline for one output format
+
+    Parameters
+    ----------
+    output : str
+        Output file format, one of ``writers.FORMATS``
+    lines : list (bytes)
+        Telegram frames, without their terminator
+    site : str
+        Site Identifier to specify instrument configuration
+    input_args : argparse.Namespace
+        Benchmark options
+    outdir : pathlib.Path
+        Directory the output files are written to
+
+    Output
+    ------
+    results : dict
+        Throughput, stage latencies, file sizes and memory of the run
+    """
+    telegram, telegram_units, publish_list, publish_parms = define_telegram(
+        site, input_args.telegram)
+    codes = telegram_codes(telegram)
+    qc = QualityControl() if input_args.qc else None
+    extra = tuple(qc_fields(codes)) if qc else ()
+    decoder = compile_decoder(tuple(codes), extra)
+    plugin = NullPlugin()
+    publisher = Publisher(plugin,
+                          publish_parms,
+                          [decoder.names[parm - 1] for parm in publish_list],
+                          [{"units": telegram_units[parm]} for parm in publish_list],
+                          batch_size=input_args.publish_batch)
+    products = None
+    if input_args.products and ("raw_spectrum" in decoder.dtype.names
+                                or "nd" in decoder.dtype.names):
+        products = Publisher(plugin, [f"parsivel.dsd.{name}" for name in PRODUCTS],
+                             list(PRODUCTS),
+                             [{"units": units} for units, _ in PRODUCTS.values()],
+                             batch_size=input_args.publish_batch)
+
+    timings = {stage: [] for stage in STAGES}
+    memory = []
+    per_file = max(1, input_args.freq * 60 // input_args.interval)
+    nfile = 0
+
+    def open_file():
+        path = outdir / f"{site}.parsivel2.{output}.{nfile:06d}.{FORMATS[output]}"
+        return open_writer(output, path, telegram, telegram_units, decoder)
+
+    clock = time.perf_counter_ns
+    rss_start = resident_memory()
+    writer = open_file()
+    start = time.perf_counter()
+    for i, frame in enumerate(lines):
+        t0 = clock()
+        line = frame.decode("utf-8", errors="replace").strip()
+        record = decoder.decode(line, timestamp=np.datetime64(i * input_args.interval, "s"))
+        t1 = clock()
+        timings["parse"].append(t1 - t0)
+        if qc:
+            qc.apply(record)
+            t2 = clock()
+            timings["qc"].append(t2 - t1)
+            t1 = t2
+        writer.write(record, line)
+        t2 = clock()
+        timings["write"].append(t2 - t1)
+        publisher.add(record)
+        t3 = clock()
+        timings["publish"].append(t3 - t2)
+        if products:
+            products.add(compute_products(record, input_args.interval))
+            timings["products"].append(clock() - t3)
+        if (i + 1) % per_file == 0:
+            t0 = clock()
+            writer.close()
+            nfile += 1
+            writer = open_file()
+            timings["rotate"].append(clock() - t0)
+        if i % 1000 == 0:
+            memory.append(resident_memory())
+    writer.close()
+    publisher.flush()
+    if products:
+        products.flush()
+    elapsed = time.perf_counter() - start
+    rss_end = resident_memory()
+
+    written = sum(path.stat().st_size for path in outdir.glob(f"*.{output}.*"))
+    return {"format": output,
+            "records": len(lines),
+            "records_per_sec": len(lines) / elapsed,
+            "latency_us": {stage: latency_stats(samples)
+                           for stage, samples in timings.items() if samples},
+            "files": nfile + 1,
+            "bytes_per_record": written / len(lines),
+            "rss_start_mb": rss_start,
+            "rss_end_mb": rss_end,
+            "rss_max_mb": max(memory + [rss_end]),
+            "published": plugin.published}
+
+
+def print_results(results):
+    """Print a summary table of the benchmark results"""
+    framing = results["framing"]
+    print(f"Framing: {framing['frames_per_sec']:.0f} frames/s "
+          f"({framing['mb_per_sec']:.1f} MB/s)")
+    for run in results["formats"]:
+        print(f"\n{run['format']}: {run['records_per_sec']:.0f} records/s, "
+              f"{run['bytes_per_record']:.0f} bytes/record in {run['files']} files, "
+              f"RSS {run['rss_start_mb']:.1f} -> {run['rss_end_mb']:.1f} MB "
+              f"(max {run['rss_max_mb']:.1f})")
+        print(f"    {'stage':<10}{'mean':>10}{'p50':>10}{'p99':>10}  (us)")
+        for stage, stats in run["latency_us"].items():
+            print(f"    {stage:<10}{stats['mean']:>10.1f}{stats['p50']:>10.1f}"
+                  f"{stats['p99']:>10.1f}")
+
+
+def main(input_args):
+    """Generate telegrams and benchmark each output format"""
+    telegram = define_telegram(input_args.site, input_args.telegram)[0]
+    simulator = Simulator(telegram_codes(telegram), input_args.interval,
+                          seed=input_args.seed, rain_onset=input_args.rain)
+    print(f"Generating {input_args.records} telegrams for site {input_args.site}")
+    lines = [simulator.telegram() for _ in range(input_args.records)]
+    results = {"site": input_args.site,
+               "options": vars(input_args),
+               "framing": benchmark_framing(lines),
+               "formats": []}
+    frames = [line.rstrip(b"\r\n") for line in lines]
+    for output in input_args.formats:
+        with tempfile.TemporaryDirectory(dir=input_args.outdir) as outdir:
+            results["formats"].append(
+                benchmark_format(output, frames, input_args.site, input_args, Path(outdir)))
+    print_results(results)
+    if input_args.json:
+        with open(input_args.json, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=2)
+        print(f"\nResults saved to {input_args.json}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Parsivel2 record pipeline with simulated telegrams")
+    parser.add_argument("--records",
+                        type=int,
+                        dest="records",
+                        default=5000,
+                        help="[int] Number of Telegrams to Process per Format"
+                        )
+    parser.add_argument("--formats",
+                        type=str,
+                        nargs="+",
+                        dest="formats",
+                        default=sorted(FORMATS),
+                        choices=sorted(FORMATS),
+                        help="[str] Output Formats to Benchmark"
+                        )
+    parser.add_argument("--site",
+                        type=str,
+                        dest="site",
+                        default="atmos",
+                        help="[str] Site Identifer whose Telegram is Simulated"
+                        )
+    parser.add_argument("--telegram",
+                        type=str,
+                        dest="telegram",
+                        default=None,
+                        help="[str] Telegram to Simulate, Overriding the Site Default"
+                        )
+    parser.add_argument("--interval",
+                        type=int,
+                        dest="interval",
+                        default=60,
+                        help="[int] Simulated Sampling Interval of the Instrument (seconds)"
+                        )
+    parser.add_argument("--freq",
+                        type=int,
+                        dest="freq",
+                        default=5,
+                        help="[int] Temporal Frequency of File Generation (minutes)"
+                        )
+    parser.add_argument("--rain",
+                        type=float,
+                        dest="rain",
+                        default=0.05,
+                        help="[float] Probability of Rain Starting in a Dry Interval"
+                        )
+    parser.add_argument("--qc",
+                        action="store_true",
+                        dest="qc",
+                        help="Include Quality Control in the Pipeline"
+                        )
+    parser.add_argument("--products",
+                        action="store_true",
+                        dest="products",
+                        help="Include DSD Products in the Pipeline"
+                        )
+    parser.add_argument("--publish-batch",
+                        type=int,
+                        dest="publish_batch",
+                        default=1,
+                        help="[int] Number of Records to Publish Together"
+                        )
+    parser.add_argument("--seed",
+                        type=int,
+                        dest="seed",
+                        default=0,
+                        help="[int] Random Seed for Reproducible Telegrams"
+                        )
+    parser.add_argument("--outdir",
+                        type=str,
+                        dest="outdir",
+                        default=None,
+                        help="[str] Directory for the Temporary Output Files"
+                        )
+    parser.add_argument("--json",
+                        type=str,
+                        dest="json",
+                        default=None,
+                        help="[str] File to Save the Results to as JSON"
+                        )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,162 @@
+"""
+This module keeps a local SQLite index of files downloaded from Beehive
+
+The manifest records every file that is on disk, keyed by node, plugin,
+upload timestamp and filename, together with the time of the last
+successful sync for each node/plugin pair. ``plugin_download.py`` uses it to
+only fetch files newer than the last run and to report gaps in the record
+without querying Beehive.
+"""
+
+import datetime
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    node TEXT NOT NULL,
+    plugin TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    url TEXT,
+    path TEXT,
+    size INTEGER,
+    downloaded_at TEXT,
+    PRIMARY KEY (node, plugin, timestamp, filename)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    node TEXT NOT NULL,
+    plugin TEXT NOT NULL,
+    last_timestamp TEXT NOT NULL,
+    last_run TEXT NOT NULL,
+    PRIMARY KEY (node, plugin)
+);
+"""
+
+# Timestamps are stored as sortable ISO 8601 UTC strings
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def format_timestamp(timestamp):
+    """Convert a datetime (or pandas Timestamp) to the manifest format"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return timestamp.strftime(TIME_FORMAT)
+
+
+def parse_timestamp(timestamp):
+    """Parse a manifest or command line timestamp into an aware datetime"""
+    parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+class Manifest:
+    """
+    SQLite index of downloaded files
+
+    Parameters
+    ----------
+    path : str
+        Location of the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Commit and close the database"""
+        self.conn.commit()
+        self.conn.close()
+
+    def has(self, node, plugin, timestamp, filename):
+        """Check whether a file has already been downloaded"""
+        row = self.conn.execute(
+            "SELECT 1 FROM files WHERE node=? AND plugin=? AND timestamp=? AND filename=?",
+            (node, plugin, format_timestamp(timestamp), filename)).fetchone()
+        return row is not None
+
+    def add(self, node, plugin, timestamp, filename, url, path, size):
+        """
+        Record a file that is now on disk
+
+        Parameters
+        ----------
+        node : str
+            Waggle Node Where the Plugin Ran
+        plugin : str
+            Waggle Plugin the file was uploaded by
+        timestamp : datetime
+            Beehive timestamp of the upload
+        filename : str
+            Filename reported by Beehive
+        url : str
+            Location the file was downloaded from
+        path : str
+            Local path of the downloaded file
+        size : int
+            Size of the local file in bytes
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (node, plugin, format_timestamp(timestamp), filename, url, path, size,
+             format_timestamp(datetime.datetime.now(datetime.timezone.utc))))
+        self.conn.commit()
+
+    def last_sync(self, node, plugin):
+        """Timestamp up to which all files have been downloaded, or None"""
+        row = self.conn.execute(
+            "SELECT last_timestamp FROM sync_state WHERE node=? AND plugin=?",
+            (node, plugin)).fetchone()
+        return row[0] if row else None
+
+    def mark_synced(self, node, plugin, timestamp):
+        """Record that every file up to ``timestamp`` is on disk"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+            (node, plugin, format_timestamp(timestamp),
+             format_timestamp(datetime.datetime.now(datetime.timezone.utc))))
+        self.conn.commit()
+
+    def gaps(self, node, plugin, start, end, expected):
+        """
+        Find periods without downloaded files
+
+        Parameters
+        ----------
+        node : str
+            Waggle Node Where the Plugin Ran
+        plugin : str
+            Waggle Plugin the files were uploaded by
+        start, end : datetime
+            Window to check
+        expected : datetime.timedelta
+            Expected time between files; longer spacing is reported as a gap
+
+        Output
+        ------
+        gaps : list (tuple)
+            (last file before the gap, first file after it) timestamp pairs,
+            using the window bounds when the gap touches the start or end
+        """
+        lower, upper = format_timestamp(start), format_timestamp(end)
+        stamps = [lower]
+        stamps.extend(row[0] for row in self.conn.execute(
+            "SELECT DISTINCT timestamp FROM files "
+            "WHERE node=? AND plugin=? AND timestamp>=? AND timestamp<=? "
+            "ORDER BY timestamp",
+            (node, plugin, lower, upper)))
+        stamps.append(upper)
+        gaps = []
+        for before, after in zip(stamps[:-1], stamps[1:]):
+            if parse_timestamp(after) - parse_timestamp(before) > expected:
+                gaps.append((before, after))
+        return gaps
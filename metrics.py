@@ -0,0 +1,206 @@
+"""
+This module keeps runtime metrics of the plugin and publishes them to Beehive
+
+Counters, gauges and latency histograms are plain Python numbers and lists
+updated in place, cheap enough to sit in the per-record hot path. When
+enabled with ``--metrics-interval``, a snapshot is published every interval
+as ``parsivel.plugin.<name>`` so data loss and slow stages show up on the
+node's dashboards without logging in. To keep the message rate down only
+values that changed since they were last published are sent:
+
+counters
+    Totals since startup, e.g. ``records``, ``reconnects``
+gauges
+    Current values, e.g. ``upload_queue_depth``, ``file_bytes``
+histograms
+    Latency in seconds over the last interval, then reset; ``snapshot``
+    holds ``<name>.count``, ``.mean``, ``.p50``, ``.p99`` and ``.max`` while
+    only ``.p50`` and ``.p99`` are published
+"""
+
+import math
+import os
+import time
+
+from bisect import bisect_left
+
+# Fallback reference for process_uptime where /proc is not available
+_IMPORTED = time.monotonic()
+
+# Histogram statistics published to Beehive
+PUBLISHED_STATS = ("p50", "p99")
+
+# Histogram bucket upper bounds (s), four per decade from 10 us to 100 s
+LATENCY_BOUNDS = [1e-5 * 10 ** (i / 4) for i in range(29)]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of latencies
+
+    Parameters
+    ----------
+    bounds : list (float)
+        Increasing bucket upper bounds in seconds; larger values fall in an
+        overflow bucket
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Add one measurement in seconds"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile"""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        """Count, mean, median, 99th percentile and maximum"""
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else math.nan,
+                "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99),
+                "max": self.max if self.count else math.nan}
+
+    def reset(self):
+        """Start a new interval"""
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Metrics:
+    """Named counters, gauges and latency histograms"""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # Metric name -> value last published
+        self._published = {}
+
+    def incr(self, name, value=1):
+        """Add to a counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """Set a gauge to its current value"""
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Add a latency measurement to a histogram"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def snapshot(self, stats=None):
+        """
+        Current value of every metric
+
+        Parameters
+        ----------
+        stats : sequence (str), optional
+            Histogram statistics to include, all by default
+
+        Output
+        ------
+        values : dict
+            Metric name -> value, histograms flattened to ``<name>.<stat>``
+        """
+        values = dict(self.counters)
+        values.update(self.gauges)
+        for name, histogram in self.histograms.items():
+            for stat, value in histogram.summary().items():
+                if stats is None or stat in stats:
+                    values[f"{name}.{stat}"] = value
+        return values
+
+    def publish(self, plugin, meta, prefix="parsivel.plugin"):
+        """
+        Publish the metrics that changed and start a new histogram interval
+
+        Parameters
+        ----------
+        plugin : waggle.plugin.Plugin
+            Plugin session shared by all instruments
+        meta : dict
+            Metadata attached to every metric, e.g. the site
+        prefix : str
+            Prepended to the metric names
+
+        Output
+        ------
+        published : int
+            Number of metrics published
+        """
+        timestamp = time.time_ns()
+        published = 0
+        for name, value in self.snapshot(PUBLISHED_STATS).items():
+            # Histograms without measurements in the interval have no statistics
+            if isinstance(value, float) and not math.isfinite(value):
+                continue
+            if self._published.get(name) == value:
+                continue
+            try:
+                plugin.publish(f"{prefix}.{name}",
+                               value=value,
+                               meta=dict(meta, units=metric_units(name)),
+                               scope="node",
+                               timestamp=timestamp)
+                self._published[name] = value
+                published += 1
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Failed to publish metric {name}: {err}")
+        for histogram in self.histograms.values():
+            histogram.reset()
+        return published
+
+
+def process_uptime():
+    """
+    Seconds since the process was started, including interpreter startup
+
+    Output
+    ------
+    uptime : float
+        Wall time since the process started, or since this module was
+        imported where /proc is not available
+    """
+    try:
+        with open("/proc/self/stat", encoding="ascii") as stat:
+            # Fields after the parenthesised command name, starttime is 22nd
+            fields = stat.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="ascii") as uptime:
+            boot = float(uptime.read().split()[0])
+        return boot - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED
+
+
+def metric_units(name):
+    """Units of a metric from its name"""
+    if ("latency" in name and not name.endswith(".count")) or name.endswith("_seconds"):
+        return "s"
+    if "bytes" in name:
+        return "bytes"
+    return "count"
@@ -0,0 +1,148 @@
+"""
+This module reads Parsivel2 CSV files written by the plugin and merges them
+into one columnar NetCDF dataset per day
+
+Each file carries its telegram description in its first header row, which
+is used to compile a ``TelegramDecoder`` (cached per telegram) so the
+%90/%91/%93 columns are decoded straight into NumPy arrays. Files are parsed
+in parallel across a process pool, gzip or zstd compressed files are read
+directly, records duplicated across files are dropped and the result is
+written with the same NetCDF layout as the plugin's ``--format netcdf``.
+
+Example:
+python parsivel_reader.py data/*.csv --outdir merged
+"""
+
+import argparse
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from writers import field_attrs, read_csv, write_netcdf
+
+
+# Value of fields missing from a file's layout when it is widened, zero otherwise
+MISSING = {"nd": -9.999}
+
+
+def widen(records, dtype):
+    """Convert records to a layout with more fields, filling the missing ones"""
+    out = np.zeros(len(records), dtype=dtype)
+    for name in dtype.names:
+        if name in records.dtype.names:
+            out[name] = records[name]
+        elif name in MISSING:
+            out[name] = MISSING[name]
+    return out
+
+
+def merge_records(chunks):
+    """Concatenate record arrays, sort by time and drop duplicated times"""
+    records = np.concatenate(chunks)
+    _, first = np.unique(records["time"], return_index=True)
+    return records[first]
+
+
+def merge_files(files, outdir, site="parsivel", workers=None):
+    """
+    Merge plugin CSV files into one NetCDF file per day
+
+    Parameters
+    ----------
+    files : list (str)
+        CSV files written by the plugin, in any order
+    outdir : str
+        Directory to write the daily files to
+    site : str
+        Site identifier used in the output filenames
+    workers : int, optional
+        Number of processes used to parse files
+
+    Output
+    ------
+    written : list (pathlib.Path)
+        Daily files written
+    """
+    # Files are named by their start time, so sorting by name orders them
+    files = sorted(files, key=lambda fname: Path(fname).name.split("parsivel2.")[-1])
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    written = []
+    pending = []
+    attrs = {}
+
+    def flush(before=None):
+        """Write every complete day preceding ``before``"""
+        if not pending:
+            return
+        records = merge_records(pending)
+        days = records["time"].astype("datetime64[D]")
+        pending.clear()
+        if before is not None:
+            keep = days >= before
+            if keep.any():
+                pending.append(records[keep])
+            records, days = records[~keep], days[~keep]
+        for day in np.unique(days):
+            out_path = outdir / f"{site}.parsivel2.{str(day).replace('-', '')}.nc"
+            write_netcdf(out_path, records[days == day], attrs)
+            written.append(out_path)
+            print(f"Wrote {out_path}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map preserves order, so days complete as later files arrive
+        for path, records in zip(files, pool.map(read_csv, files, chunksize=4)):
+            if not len(records):
+                continue
+            if pending and records.dtype != pending[0].dtype:
+                names, pending_names = set(records.dtype.names), set(pending[0].dtype.names)
+                if names < pending_names:
+                    # Scalar-only file written in dry weather (--adaptive)
+                    records = widen(records, pending[0].dtype)
+                elif names > pending_names:
+                    pending[:] = [widen(chunk, records.dtype) for chunk in pending]
+                    attrs = field_attrs(path)
+                else:
+                    # Telegram changed between files, finish the previous layout
+                    flush()
+            if not pending:
+                attrs = field_attrs(path)
+            flush(before=records["time"].min().astype("datetime64[D]"))
+            pending.append(records)
+        flush()
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Merge Parsivel2 CSV files into daily NetCDF files")
+    parser.add_argument("files",
+                        nargs="+",
+                        help="[str] Plugin CSV files to merge"
+                        )
+    parser.add_argument("--outdir",
+                        type=str,
+                        dest="outdir",
+                        default=".",
+                        help="[str] Directory where to output files to"
+                        )
+    parser.add_argument("--site",
+                        type=str,
+                        dest="site",
+                        default=None,
+                        help="[str] Site Identifer for the output files (default from filenames)"
+                        )
+    parser.add_argument("--workers",
+                        type=int,
+                        dest="workers",
+                        default=os.cpu_count(),
+                        help="[int] Number of Processes Parsing Files"
+                        )
+    args = parser.parse_args()
+    if args.site is None:
+        args.site = Path(args.files[0]).name.split(".parsivel2.")[0].split("_")[-1]
+
+    merge_files(args.files, args.outdir, args.site, args.workers)
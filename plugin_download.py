@@ -7,42 +7,105 @@ https://github.com/RBhupi/Konza_Mobo_Analysis
 
 import argparse
 import os
+import re
+import time
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from zoneinfo import ZoneInfo
 
 import sage_data_client
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def readtofile(uurl, fname, input_args):
+from manifest import Manifest, parse_timestamp
+
+CHUNK_SIZE = 1 << 20
+
+def make_session(input_args):
+    """
+    Create a pooled HTTP session shared by all download workers
+
+    Parameters
+    ----------
+    input_args : dictionary
+        Input Argument dictionary
+    """
+    session = requests.Session()
+    session.auth = (input_args.user, input_args.password)
+    adapter = HTTPAdapter(pool_connections=input_args.workers,
+                          pool_maxsize=input_args.workers,
+                          max_retries=Retry(total=3,
+                                            backoff_factor=1,
+                                            status_forcelist=[500, 502, 503, 504]))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def readtofile(session, uurl, fname):
     """
     Given a URL, read data to local files
 
+    Files already present with the size reported by the server are skipped.
+    Downloads are streamed to ``<fname>.part`` and resumed with a Range
+    request if interrupted, then renamed into place once complete.
+
     Parameters
     ----------
+    session : requests.Session
+        Pooled session used for the request
     uurl : str
         HTML consisting of file to download from Beehive
     fname : str
         Path for local location to store data into
-    input_args : dictionary
-        Input Argument dictionary
+
+    Output
+    ------
+    status : str
+        One of "downloaded", "skipped" or "failed"
+    nbytes : int
+        Number of bytes transferred
     """
-    r = requests.get(uurl,
-                     auth=(input_args.user, input_args.password),
-                     timeout=25)
-    print(r.status_code)
-    if r.status_code == 200:
-        print("Downloading ... ", fname)
-        with open(fname, 'wb') as out:
-            for bits in r.iter_content():
+    part = fname + ".part"
+    etag_file = fname + ".etag"
+    if os.path.exists(fname):
+        head = session.head(uurl, timeout=25, allow_redirects=True)
+        size = head.headers.get("Content-Length")
+        if head.status_code == 200 and (size is None or int(size) == os.path.getsize(fname)):
+            return "skipped", 0
+
+    headers = {}
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if os.path.exists(etag_file):
+            with open(etag_file, encoding="utf-8") as etag:
+                headers["If-Range"] = etag.read().strip()
+
+    with session.get(uurl, headers=headers, stream=True, timeout=25) as r:
+        if r.status_code == 404:
+            print("404 Error: File Not Found - ", uurl)
+            return "failed", 0
+        if r.status_code not in (200, 206):
+            print("HTML Request Status - ", r.status_code, uurl)
+            return "failed", 0
+        if "ETag" in r.headers:
+            with open(etag_file, "w", encoding="utf-8") as etag:
+                etag.write(r.headers["ETag"])
+        # A 200 means the server sent the whole file, start over
+        mode = "ab" if r.status_code == 206 else "wb"
+        nbytes = 0
+        with open(part, mode) as out:
+            for bits in r.iter_content(chunk_size=CHUNK_SIZE):
                 out.write(bits)
-    elif r.status_code == 404:
-        print("404 Error: File Not Found")
-    else:
-        print("HTML Request Status - ", r.status_code)
-    return True
+                nbytes += len(bits)
+    os.replace(part, fname)
+    if os.path.exists(etag_file):
+        os.remove(etag_file)
+    return "downloaded", nbytes
 
-def download_files_beehive(df, input_args):
+def download_files_beehive(df, input_args, manifest=None):
     """
     Download files from Beehive given a pandas dataframe of their
     HTML locations
@@ -51,46 +114,143 @@ def download_files_beehive(df, input_args):
     ----------
     df : Pandas DataFrame
         Dataframe generated from Beehive JSON of file locations
-    file_ext : str
-        File extension of the files to download
-    out_dir : str
-        Path defined to save files to
-    username : str
-        Waggle/SAGE UI username
-    password : str
-        Waggle/SAGE UI authorized password
+    input_args : dictionary
+        Input Argument dictionary, defines the file extension, output
+        directory, credentials and number of download workers
+    manifest : manifest.Manifest, optional
+        Local index of downloaded files; files it already lists are not
+        requested again and new downloads are added to it
+
+    Output
+    ------
+    counts : dict
+        Number of files downloaded, skipped, already indexed and failed
+    failed_timestamps : list
+        Beehive timestamps of the files that failed to download
     """
     print("in download")
-    url_locations = []
-    beehive_timestamp = []
-    beehive_files = []
-    if "image_sampler" or "imagesampler" in input_args.plugin:
+    df = df[df["value"].str.contains(input_args.extension, regex=False)]
+    if is_image_sampler(input_args.plugin):
         print("in image_sampler")
-        for i in range(len(df)):
-            if input_args.extension in df.iloc[i].value:
-                url_locations.append(df.iloc[i].value)
-                beehive_timestamp.append(df.iloc[i].timestamp)
-                beehive_files.append(input_args.node +
-                                     "_" +
-                                     beehive_timestamp[i].strftime("%Y%m%d_%H%M%S") +
-                                     '_' + 
-                                     df.iloc[i]["meta.filename"])
+        beehive_files = (input_args.node +
+                         "_" +
+                         df["timestamp"].dt.strftime("%Y%m%d_%H%M%S") +
+                         "_" +
+                         df["meta.filename"])
     else:
-        for i in range(len(df)):
-            if input_args.extension in df.iloc[i].value:
-                url_locations.append(df.iloc[i].value)
-                beehive_timestamp.append(df.iloc[i].timestamp)
-                beehive_files.append(df.iloc[i]["meta.filename"])
+        beehive_files = df["meta.filename"]
+    downloads = list(zip(df["value"],
+                         [os.path.join(input_args.outdir, fname) for fname in beehive_files],
+                         df["timestamp"],
+                         df["meta.filename"]))
+    counts = {"downloaded": 0, "skipped": 0, "failed": 0, "indexed": 0}
+    if manifest is not None:
+        # Files already listed in the manifest need no network round trip
+        downloads = [download for download in downloads
+                     if not manifest.has(input_args.node, input_args.plugin,
+                                         download[2], download[3])]
+        counts["indexed"] = len(df) - len(downloads)
 
     # Download and save to output directory
-    for i, beehive_timestamp in enumerate(beehive_timestamp):
-        filename = os.path.join(input_args.outdir, beehive_files[i])
-        print(beehive_timestamp, filename)
-        readtofile(url_locations[i], filename, input_args)
+    failed_timestamps = []
+    total_bytes = 0
+    start = time.monotonic()
+    with make_session(input_args) as session, \
+            ThreadPoolExecutor(max_workers=input_args.workers) as pool:
+        futures = {pool.submit(readtofile, session, download[0], download[1]): download
+                   for download in downloads}
+        for i, future in enumerate(as_completed(futures), start=1):
+            url, filename, beehive_timestamp, beehive_name = futures[future]
+            try:
+                status, nbytes = future.result()
+            except requests.RequestException as err:
+                status, nbytes = "failed", 0
+                print("Download error - ", err)
+            if status == "failed":
+                failed_timestamps.append(beehive_timestamp)
+            elif manifest is not None:
+                manifest.add(input_args.node, input_args.plugin, beehive_timestamp,
+                             beehive_name, url, filename, os.path.getsize(filename))
+            counts[status] += 1
+            total_bytes += nbytes
+            print(f"[{i}/{len(downloads)}] {status}: {beehive_timestamp} {filename}")
+
+    elapsed = time.monotonic() - start
+    print(f"Downloaded {counts['downloaded']}, skipped {counts['skipped']}, "
+          f"already indexed {counts['indexed']}, "
+          f"failed {counts['failed']} files; {total_bytes / 1e6:.1f} MB in "
+          f"{elapsed:.1f} s ({total_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s)")
+
+    return counts, failed_timestamps
+
+def is_image_sampler(plugin):
+    """Image sampler uploads are queried by task rather than plugin"""
+    return "image_sampler" in plugin or "imagesampler" in plugin
+
+def query_uploads(input_args):
+    """
+    Query Beehive for uploaded files one time window at a time
+
+    The plugin (or task), upload and file extension filters are sent with
+    the request so only matching records are returned, and long ranges are
+    split into --chunk-days windows so memory stays flat.
+
+    Parameters
+    ----------
+    input_args : dictionary
+        Input Argument dictionary
+
+    Output
+    ------
+    chunks : generator (Pandas DataFrame)
+        Upload records for each non-empty time window, in time order
+    """
+    query_filter = {"vsn": input_args.node,
+                    "name": "upload",
+                    # Anchored regex, also matching files compressed by --compress
+                    "filename": f".*\\.{re.escape(input_args.extension)}(\\.(gz|zst))?"}
+    if is_image_sampler(input_args.plugin):
+        query_filter["task"] = input_args.task
+    else:
+        query_filter["plugin"] = input_args.plugin
+
+    window = datetime.timedelta(days=input_args.chunk_days)
+    start = parse_timestamp(input_args.start_date)
+    end = parse_timestamp(input_args.end_date)
+    while start < end:
+        stop = min(start + window, end)
+        df = sage_data_client.query(start=start.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                                    end=stop.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                                    filter=query_filter)
+        print(f"{start} - {stop}: {len(df)} files")
+        if len(df):
+            yield df
+        start = stop
 
 def main(input_args):
     """Download data from Beehive for the Plugin in Question"""
 
+    manifest = Manifest(input_args.manifest or
+                        os.path.join(input_args.outdir, "manifest.sqlite"))
+
+    # Report gaps in the local record without querying Beehive
+    if input_args.gaps:
+        gaps = manifest.gaps(input_args.node, input_args.plugin,
+                             parse_timestamp(input_args.start_date),
+                             parse_timestamp(input_args.end_date),
+                             datetime.timedelta(minutes=input_args.gaps))
+        for before, after in gaps:
+            print(f"Gap: {before} -> {after}")
+        print(f"{len(gaps)} gaps longer than {input_args.gaps} minutes")
+        manifest.close()
+        return
+
+    # Only query what is newer than the last successful sync
+    if input_args.sync:
+        last_sync = manifest.last_sync(input_args.node, input_args.plugin)
+        if last_sync:
+            input_args.start_date = last_sync
+
     print("\n")
     print("Node: ", input_args.node)
     print("Plugin: ", input_args.plugin)
@@ -99,27 +259,20 @@ def main(input_args):
     print("End Date: ", input_args.end_date)
     print("\n")
 
-    # Define the JSON output for files in question
-    if "image_sampler" or "imagesampler" in input_args.plugin:
-        df = sage_data_client.query(start=input_args.start_date,
-                                    end=input_args.end_date,
-                                    filter={"vsn": input_args.node,
-                                            "task": input_args.task,
-                                            }
-        )
-    else:
-        df = sage_data_client.query(start=input_args.start_date,
-                                    end=input_args.end_date,
-                                    filter={"vsn": input_args.node,
-                                            "plugin": input_args.plugin,
-                                            }
-        )
-    print(df)
-    print("\n")
-    print(df.iloc[0]["meta.plugin"])
-
-    # Download the files
-    download_files_beehive(df, input_args)
+    # Stream the query window by window into the downloader
+    synced = True
+    with manifest:
+        for df in query_uploads(input_args):
+            _, failed_timestamps = download_files_beehive(df, input_args, manifest)
+            # Everything before the earliest failure is now on disk
+            if synced:
+                if failed_timestamps:
+                    synced = False
+                    manifest.mark_synced(input_args.node, input_args.plugin,
+                                         min(failed_timestamps))
+                else:
+                    manifest.mark_synced(input_args.node, input_args.plugin,
+                                         df["timestamp"].max())
 
 if __name__ == '__main__':
 
@@ -175,7 +328,38 @@ if __name__ == '__main__':
                         type=str,
                         default="csv",
                         dest="extension",
-                        help="[str] Extension of Files to Download"
+                        help=("[str] Extension of Files to Download, Including their " +
+                              ".gz or .zst Compressed Copies")
+                        )
+    parser.add_argument("--workers",
+                        type=int,
+                        default=8,
+                        dest="workers",
+                        help="[int] Number of Concurrent Downloads"
+                        )
+    parser.add_argument("--manifest",
+                        type=str,
+                        default=None,
+                        dest="manifest",
+                        help="[str] SQLite Index of Downloaded Files (default OUTDIR/manifest.sqlite)"
+                        )
+    parser.add_argument("--sync",
+                        action="store_true",
+                        dest="sync",
+                        help="Only Download Files Newer than the Last Successful Sync"
+                        )
+    parser.add_argument("--gaps",
+                        type=int,
+                        default=None,
+                        dest="gaps",
+                        help=("[int] Report Gaps Longer than this Many Minutes in the " +
+                              "Local Index between --start and --end, then Exit")
+                        )
+    parser.add_argument("--chunk-days",
+                        type=float,
+                        default=1,
+                        dest="chunk_days",
+                        help="[float] Length of Each Beehive Query Window in Days"
                         )
     parser.add_argument("--task",
                         type=str,
@@ -0,0 +1,83 @@
+"""
+This module tracks whether it is raining from decoded Parsivel2 records
+
+During dry weather the drop spectra are empty, so there is no need to write
+them or to rotate files as often as during rain. ``PrecipitationState``
+switches to rain as soon as the rain intensity (%01) or the number of
+detected particles (%11/%60) crosses its threshold, and only switches back
+to dry once both have stayed below half of their thresholds for a number of
+consecutive records. The two thresholds and the delay give hysteresis, so
+showers and drizzle do not flip the mode back and forth.
+"""
+
+PARTICLE_FIELDS = ("particles_validated", "particles_detected")
+
+
+class PrecipitationState:
+    """
+    Dry/rain state with hysteresis
+
+    Parameters
+    ----------
+    names : sequence (str)
+        Field names of the decoded records
+    rain_threshold : float
+        Rain intensity (mm/hr) at which rain mode starts
+    particle_threshold : int
+        Number of particles per record at which rain mode starts
+    dry_records : int
+        Consecutive records below half the thresholds before dry mode resumes
+    """
+
+    def __init__(self, names, rain_threshold=0.1, particle_threshold=10, dry_records=30):
+        self.intensity = "rain_intensity" if "rain_intensity" in names else None
+        self.particles = next((name for name in PARTICLE_FIELDS if name in names), None)
+        if self.intensity is None and self.particles is None:
+            raise ValueError("Adaptive mode needs %01 or %11/%60 in the telegram")
+        self.rain_threshold = rain_threshold
+        self.particle_threshold = particle_threshold
+        self.dry_records = max(1, dry_records)
+        self.raining = False
+        self._dry_count = 0
+
+    def _exceeds(self, record, fraction):
+        """Whether the record is above ``fraction`` of either threshold"""
+        if self.intensity and record[self.intensity] >= fraction * self.rain_threshold:
+            return True
+        return bool(self.particles and
+                    record[self.particles] >= fraction * self.particle_threshold)
+
+    def update(self, record):
+        """
+        Update the state with a new record
+
+        Parameters
+        ----------
+        record : numpy.void
+            Decoded record from ``TelegramDecoder.decode``
+
+        Output
+        ------
+        changed : bool
+            True if the record switched between dry and rain
+        """
+        if not self.raining:
+            if self._exceeds(record, 1.0):
+                self.raining = True
+                self._dry_count = 0
+                return True
+            return False
+        if self._exceeds(record, 0.5):
+            self._dry_count = 0
+            return False
+        self._dry_count += 1
+        if self._dry_count >= self.dry_records:
+            self.raining = False
+            self._dry_count = 0
+            return True
+        return False
+
+    @property
+    def mode(self):
+        """Name of the current mode"""
+        return "rain" if self.raining else "dry"
@@ -0,0 +1,111 @@
+"""
+This module publishes selected Parsivel2 parameters to Beehive
+
+A single ``Publisher`` wraps the plugin session owned by the application,
+buffers decoded records and publishes the configured parameters for a batch
+of records at once, keeping count of publish latency and failures.
+"""
+
+import math
+import time
+
+import numpy as np
+
+from metrics import Histogram
+
+
+def record_timestamp(record):
+    """Return a record's receive time as nanoseconds since the epoch"""
+    return int(record["time"].astype("datetime64[ns]").astype(np.int64))
+
+
+def _item(value):
+    """Convert a NumPy scalar into the equivalent Python value"""
+    return value.item()
+
+
+class Publisher:
+    """
+    Batched publishing of decoded records through a long-lived plugin
+
+    Parameters
+    ----------
+    plugin : waggle.plugin.Plugin
+        Open plugin session shared for the lifetime of the process
+    publish_parms : list (str)
+        Short names of parameters to publish to beehive
+    fields : list (str)
+        Record field holding the value for each published parameter
+    meta : list (dict)
+        Metadata to attach to each published parameter
+    batch_size : int
+        Number of records to buffer before publishing them together
+    encoders : dict or None
+        Record field -> function converting its value into a publishable
+        one, e.g. ``spectrum_codec.encode_spectrum`` for array fields
+    """
+
+    def __init__(self, plugin, publish_parms, fields, meta, batch_size=1, encoders=None):
+        self.plugin = plugin
+        self.params = list(zip(publish_parms, fields, meta))
+        encoders = encoders or {}
+        self._convert = [encoders.get(field, _item) for field in fields]
+        self.batch_size = max(1, batch_size)
+        self.published = 0
+        self.failures = 0
+        self.batches = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency = Histogram()
+        self._buffer = []
+
+    def add(self, record):
+        """
+        Queue a record for publishing, flushing once the batch is full
+
+        Parameters
+        ----------
+        record : numpy.void
+            Decoded record from ``TelegramDecoder.decode``
+        """
+        # Copy the values out, the record may be reused by the caller
+        self._buffer.append((record_timestamp(record),
+                             [convert(record[field]) for (_, field, _), convert
+                              in zip(self.params, self._convert)]))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Publish all buffered records"""
+        if not self._buffer:
+            return
+        start = time.perf_counter()
+        for timestamp, values in self._buffer:
+            for (name, _, meta), value in zip(self.params, values):
+                # Derived products are undefined (NaN) without any drops
+                if isinstance(value, float) and not math.isfinite(value):
+                    continue
+                try:
+                    self.plugin.publish(name,
+                                        value=value,
+                                        meta=meta,
+                                        scope="node",
+                                        timestamp=timestamp)
+                    self.published += 1
+                except Exception as err:  # pylint: disable=broad-except
+                    self.failures += 1
+                    print(f"Failed to publish {name}: {err}")
+        elapsed = time.perf_counter() - start
+        self._buffer.clear()
+        self.batches += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+        self.latency.observe(elapsed)
+
+    def stats(self):
+        """Summary of publish counts and batch latency in seconds"""
+        return {"published": self.published,
+                "failures": self.failures,
+                "batches": self.batches,
+                "latency_mean": self.latency_total / max(self.batches, 1),
+                "latency_max": self.latency_max}
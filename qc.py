@@ -0,0 +1,177 @@
+"""
+This module applies quality control to decoded Parsivel2 records
+
+Each record receives a bit field of quality flags derived from the sensor
+status, error code and housekeeping (supply voltage, heating, sensor head
+temperatures), and a cleaned copy of the %93 raw spectrum in which counts
+inconsistent with raindrop fall speeds are removed. The spectrum filter is a
+fixed diameter x velocity mask, so cleaning any number of records is a
+single vectorized multiply.
+"""
+
+import numpy as np
+
+from products import DIAMETER_CENTERS, VELOCITY_CENTERS, terminal_velocity
+
+# Quality flag bits
+FLAG_STATUS = 1 << 0       # %18 sensor status reports a fault
+FLAG_ERROR = 1 << 1        # %25 error code is set
+FLAG_VOLTAGE = 1 << 2      # %17 supply voltage outside the allowed range
+FLAG_HEATING = 1 << 3      # %16 heating current or %12 heating temperature out of range
+FLAG_TEMPERATURE = 1 << 4  # %27/%28 sensor head temperatures out of range
+FLAG_SPECTRUM = 1 << 5     # most of the counted drops failed the spectrum filter
+
+FLAG_MEANINGS = ["sensor_status", "error_code", "supply_voltage",
+                 "heating", "head_temperature", "spectrum_filter"]
+
+
+def qc_fields(codes):
+    """
+    Record fields added by quality control for a telegram
+
+    Parameters
+    ----------
+    codes : list (str)
+        Telegram field codes, see ``telegram.telegram_codes``
+
+    Output
+    ------
+    fields : list (tuple)
+        (name, dtype, shape) entries to append to the decoded record
+    """
+    fields = [("qc_flags", np.uint16, ())]
+    if "%93" in codes:
+        fields.append(("spectrum_qc", np.int16, (32, 32)))
+    return fields
+
+
+def spectrum_mask(velocity_tolerance=0.5, min_diameter=0.25, max_diameter=10.0):
+    """
+    Diameter x velocity classes consistent with falling raindrops
+
+    Parameters
+    ----------
+    velocity_tolerance : float
+        Allowed relative departure from the terminal velocity of the
+        diameter class. Slower drops are typically margin fallers clipped
+        by the beam edge, faster small drops are splashing fragments.
+    min_diameter : float
+        Smallest diameter (mm) kept; the two smallest classes are not
+        measured by the Parsivel2
+    max_diameter : float
+        Largest diameter (mm) kept
+
+    Output
+    ------
+    mask : numpy.ndarray (bool)
+        True for classes that are kept, (diameter, velocity)
+    """
+    expected = terminal_velocity(DIAMETER_CENTERS)[:, None]
+    departure = np.abs(VELOCITY_CENTERS[None, :] - expected) / expected
+    size = (DIAMETER_CENTERS >= min_diameter) & (DIAMETER_CENTERS <= max_diameter)
+    return (departure <= velocity_tolerance) & size[:, None]
+
+
+class QualityControl:
+    """
+    Vectorized quality control of decoded records
+
+    Parameters
+    ----------
+    velocity_tolerance : float
+        Allowed relative departure from terminal velocity, see ``spectrum_mask``
+    min_diameter, max_diameter : float
+        Diameter range (mm) kept by the spectrum filter
+    voltage_range : tuple (float)
+        Allowed supply voltage (V)
+    max_heating_current : float
+        Largest plausible sensor head heating current (A)
+    temperature_range : tuple (float)
+        Allowed sensor and head temperatures (degC)
+    max_removed : float
+        Fraction of counted drops the filter may remove before flagging
+    min_count : int
+        Minimum number of counted drops before the removed fraction is checked
+    """
+
+    def __init__(self, velocity_tolerance=0.5, min_diameter=0.25, max_diameter=10.0,
+                 voltage_range=(10.0, 30.0), max_heating_current=3.0,
+                 temperature_range=(-40.0, 70.0), max_removed=0.5, min_count=10):
+        self.mask = spectrum_mask(velocity_tolerance, min_diameter, max_diameter)
+        self.voltage_range = voltage_range
+        self.max_heating_current = max_heating_current
+        self.temperature_range = temperature_range
+        self.max_removed = max_removed
+        self.min_count = min_count
+
+    def flags(self, records):
+        """
+        Housekeeping quality flags
+
+        Parameters
+        ----------
+        records : numpy.void or numpy.ndarray
+            Decoded record(s) from ``TelegramDecoder``
+
+        Output
+        ------
+        flags : numpy.ndarray (uint16)
+            Bit field of ``FLAG_*`` values per record
+        """
+        names = records.dtype.names
+        flags = np.zeros(np.shape(records), dtype=np.uint16)
+        if "sensor_status" in names:
+            flags |= np.where(records["sensor_status"] != 0, FLAG_STATUS, 0).astype(np.uint16)
+        if "error_code" in names:
+            flags |= np.where(records["error_code"] != 0, FLAG_ERROR, 0).astype(np.uint16)
+        if "supply_voltage" in names:
+            low, high = self.voltage_range
+            voltage = records["supply_voltage"]
+            flags |= np.where((voltage < low) | (voltage > high),
+                              FLAG_VOLTAGE, 0).astype(np.uint16)
+        low, high = self.temperature_range
+        if "heating_current" in names:
+            flags |= np.where(records["heating_current"] > self.max_heating_current,
+                              FLAG_HEATING, 0).astype(np.uint16)
+        if "sensor_temperature" in names:
+            temperature = records["sensor_temperature"]
+            flags |= np.where((temperature < low) | (temperature > high),
+                              FLAG_HEATING, 0).astype(np.uint16)
+        for name in ("temperature_left", "temperature_right"):
+            if name in names:
+                temperature = records[name]
+                flags |= np.where((temperature < low) | (temperature > high),
+                                  FLAG_TEMPERATURE, 0).astype(np.uint16)
+        return flags
+
+    def clean(self, spectrum):
+        """Remove implausible drops from raw spectra, (..., diameter, velocity)"""
+        return np.where(self.mask, spectrum, 0).astype(np.int16)
+
+    def apply(self, records):
+        """
+        Flag records and store the cleaned spectrum, in place
+
+        Parameters
+        ----------
+        records : numpy.void or numpy.ndarray
+            Decoded record(s) with the ``qc_fields`` appended
+
+        Output
+        ------
+        flags : numpy.ndarray (uint16)
+            Bit field of ``FLAG_*`` values per record
+        """
+        flags = self.flags(records)
+        if "spectrum_qc" in records.dtype.names:
+            raw = records["raw_spectrum"]
+            cleaned = self.clean(raw)
+            total = raw.sum(axis=(-2, -1), dtype=np.int64)
+            kept = cleaned.sum(axis=(-2, -1), dtype=np.int64)
+            removed = np.where(total >= self.min_count,
+                               1.0 - kept / np.maximum(total, 1), 0.0)
+            flags |= np.where(removed > self.max_removed,
+                              FLAG_SPECTRUM, 0).astype(np.uint16)
+            records["spectrum_qc"] = cleaned
+        records["qc_flags"] = flags
+        return flags
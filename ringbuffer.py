@@ -0,0 +1,279 @@
+"""
+This module keeps the most recent decoded Parsivel2 records in memory and
+serves them to other plugins on the node
+
+A ``RingBuffer`` is a fixed-size structured NumPy array that new records
+overwrite oldest-first. It can be backed by a memory-mapped ``.npy`` file so
+the last hours of data survive a plugin restart. A ``CacheServer`` exposes
+the buffers over a small read-only HTTP interface returning JSON:
+
+    GET /                                    sites served
+    GET /<site>/latest                       most recent record
+    GET /<site>/range?start=...&end=...      records in a time range
+    GET /<site>/range?minutes=10             records in the last 10 minutes
+    GET /<site>/spectrum?minutes=10          spectrum summed over a time range
+
+Times are ISO 8601 UTC, e.g. 2024-06-01T12:00:00Z. ``range`` returns the
+scalar fields only unless ``fields=`` lists the ones wanted.
+"""
+
+import json
+import math
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from products import DIAMETER_CENTERS, VELOCITY_CENTERS
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent records
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        Record layout from ``TelegramDecoder.dtype``
+    capacity : int
+        Number of records kept
+    path : str or pathlib.Path, optional
+        ``.npy`` file backing the buffer. Records already in a file with the
+        same layout and capacity are kept, otherwise it is recreated.
+    """
+
+    def __init__(self, dtype, capacity, path=None):
+        self.capacity = int(capacity)
+        self.path = path
+        self._lock = threading.Lock()
+        self._buffer = None
+        if path is not None and Path(path).exists():
+            try:
+                existing = np.lib.format.open_memmap(path, mode="r+")
+            except ValueError:
+                existing = None
+            if (existing is not None and existing.dtype == dtype
+                    and existing.shape == (self.capacity,)):
+                self._buffer = existing
+        if self._buffer is None:
+            if path is None:
+                self._buffer = np.zeros(self.capacity, dtype=dtype)
+            else:
+                self._buffer = np.lib.format.open_memmap(path, mode="w+", dtype=dtype,
+                                                         shape=(self.capacity,))
+            self._buffer["time"] = np.datetime64("NaT")
+        # Empty slots carry a NaT time, the newest record is the latest time
+        times = self._buffer["time"]
+        valid = ~np.isnat(times)
+        self._count = int(valid.sum())
+        self._head = 0
+        if self._count:
+            # NaT is the smallest int64, so it never wins
+            self._head = (int(np.argmax(times.view(np.int64))) + 1) % self.capacity
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    def add(self, record):
+        """Store a record, overwriting the oldest one once full"""
+        with self._lock:
+            self._buffer[self._head] = record
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def latest(self):
+        """Most recent record, or None if the buffer is empty"""
+        with self._lock:
+            if not self._count:
+                return None
+            return self._buffer[self._head - 1].copy()
+
+    def records(self):
+        """Copy of the stored records, oldest first"""
+        with self._lock:
+            ordered = np.concatenate([self._buffer[self._head:], self._buffer[:self._head]])
+        return ordered[~np.isnat(ordered["time"])]
+
+    def range(self, start=None, end=None):
+        """
+        Records within a time range
+
+        Parameters
+        ----------
+        start, end : numpy.datetime64, optional
+            Inclusive bounds, open ended if not given
+
+        Output
+        ------
+        records : numpy.ndarray
+            Matching records, oldest first
+        """
+        records = self.records()
+        times = records["time"]
+        lower = 0 if start is None else np.searchsorted(times, start, side="left")
+        upper = len(times) if end is None else np.searchsorted(times, end, side="right")
+        return records[lower:upper]
+
+    def spectrum(self, start=None, end=None, field=None):
+        """
+        Drop spectrum summed over a time range
+
+        Parameters
+        ----------
+        start, end : numpy.datetime64, optional
+            Inclusive bounds, open ended if not given
+        field : str, optional
+            Spectrum field to sum; the quality controlled spectrum if
+            present, else the raw spectrum
+
+        Output
+        ------
+        counts : numpy.ndarray (int64)
+            Summed counts, (diameter, velocity)
+        nrecords : int
+            Number of records summed
+        """
+        if field is None:
+            field = "spectrum_qc" if "spectrum_qc" in self.dtype.names else "raw_spectrum"
+        if field not in self.dtype.names:
+            raise KeyError(field)
+        records = self.range(start, end)
+        return records[field].sum(axis=0, dtype=np.int64), len(records)
+
+    def flush(self):
+        """Write a memory-mapped buffer to disk"""
+        if isinstance(self._buffer, np.memmap):
+            self._buffer.flush()
+
+
+def _jsonable(value):
+    """Convert a NumPy value to something ``json`` can encode"""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "f" and not np.isfinite(value).all():
+            value = np.where(np.isfinite(value), value, None)
+        return value.tolist()
+    if isinstance(value, np.generic):
+        if np.issubdtype(value.dtype, np.datetime64):
+            return None if np.isnat(value) else str(value.astype("datetime64[ms]")) + "Z"
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def record_to_dict(record, names=None):
+    """Field name -> JSON value for a record"""
+    names = names or record.dtype.names
+    return {name: _jsonable(record[name]) for name in names}
+
+
+def _parse_time(text):
+    """Parse an ISO 8601 UTC time from a query string"""
+    return np.datetime64(text.rstrip("Z"), "ms")
+
+
+class _CacheHandler(BaseHTTPRequestHandler):
+    """Answer queries against the buffers of the ``CacheServer``"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        caches = self.server.caches
+        try:
+            if not parts:
+                return self._reply(200, {"sites": sorted(caches)})
+            if parts[0] not in caches or len(parts) != 2:
+                return self._reply(404, {"error": f"unknown path {url.path}"})
+            cache = caches[parts[0]]
+            if parts[1] == "latest":
+                latest = cache.latest()
+                if latest is None:
+                    return self._reply(404, {"error": "no records yet"})
+                return self._reply(200, record_to_dict(latest))
+            start, end = self._bounds(cache, query)
+            if parts[1] == "range":
+                records = cache.range(start, end)
+                if "fields" in query:
+                    names = ["time"] + [name for name in query["fields"].split(",")
+                                        if name in cache.dtype.names and name != "time"]
+                else:
+                    names = [name for name in cache.dtype.names
+                             if cache.dtype[name].shape == ()]
+                return self._reply(200, {"records": [record_to_dict(record, names)
+                                                     for record in records]})
+            if parts[1] == "spectrum":
+                counts, nrecords = cache.spectrum(start, end, query.get("field"))
+                return self._reply(200, {"start": _jsonable(start),
+                                         "end": _jsonable(end),
+                                         "records": nrecords,
+                                         "diameter": DIAMETER_CENTERS.tolist(),
+                                         "velocity": VELOCITY_CENTERS.tolist(),
+                                         "counts": counts.tolist()})
+            return self._reply(404, {"error": f"unknown query {parts[1]}"})
+        except KeyError as err:
+            return self._reply(400, {"error": f"no field {err}"})
+        except ValueError as err:
+            return self._reply(400, {"error": str(err)})
+
+    def _bounds(self, cache, query):
+        """Time range of a query, relative to the latest record for ``minutes``"""
+        if "minutes" in query:
+            latest = cache.latest()
+            end = latest["time"] if latest is not None else np.datetime64("now", "ms")
+            return end - np.timedelta64(int(float(query["minutes"]) * 60000), "ms"), end
+        start = _parse_time(query["start"]) if "start" in query else None
+        end = _parse_time(query["end"]) if "end" in query else None
+        return start, end
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        """Keep request logging off the plugin output"""
+
+
+class CacheServer:
+    """
+    Local HTTP server answering queries against ring buffers
+
+    Parameters
+    ----------
+    caches : dict
+        Site identifier -> ``RingBuffer``
+    host : str
+        Address to listen on, all interfaces by default since other plugins
+        run in their own pods and cannot reach this pod's loopback
+    port : int
+        Port to listen on
+    """
+
+    def __init__(self, caches, host="0.0.0.0", port=8090):
+        self.httpd = ThreadingHTTPServer((host, port), _CacheHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.caches = caches
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="cache-server", daemon=True)
+
+    def start(self):
+        """Serve requests from a background thread"""
+        self._thread.start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Serving recent records at http://{host}:{port}/")
+
+    def close(self):
+        """Stop serving and release the port"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
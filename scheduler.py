@@ -0,0 +1,96 @@
+"""
+This module schedules file rotation on aligned interval boundaries
+
+Rotation used to be checked once per loop iteration by comparing
+``time.gmtime()`` minutes, so boundaries slipped by up to the loop period
+and a slow iteration could miss an interval. ``RotationScheduler`` instead
+computes each boundary on the UTC clock (multiples of the period since the
+epoch, e.g. 00, 05, 10 ... minutes past the hour) and arms an event loop
+timer for it on the loop's monotonic clock. Every boundary is derived from
+the previous one rather than from when the timer happened to fire, and the
+wall clock is re-read before arming each timer, so rotation neither drifts
+nor follows monotonic/NTP clock differences.
+"""
+
+import asyncio
+import time
+
+
+def interval_start(timestamp, period):
+    """Start of the aligned interval containing ``timestamp`` (seconds since the epoch)"""
+    return timestamp - timestamp % period
+
+
+class RotationScheduler:
+    """
+    Call a function at every aligned interval boundary
+
+    Parameters
+    ----------
+    period : float
+        Interval length in seconds
+    callback : callable
+        Called on the event loop with the boundary (seconds since the epoch)
+        that starts the new interval
+
+    Attributes
+    ----------
+    lag : float
+        Seconds between the last boundary and the callback being run
+    """
+
+    def __init__(self, period, callback):
+        self.period = period
+        self.callback = callback
+        self.lag = 0.0
+        self._loop = None
+        self._handle = None
+        self._next = None
+
+    @property
+    def next_boundary(self):
+        """Boundary the scheduler is waiting for, seconds since the epoch"""
+        return self._next
+
+    def start(self, loop=None):
+        """Arm the timer for the next boundary"""
+        self._loop = loop or asyncio.get_running_loop()
+        now = time.time()
+        self._next = interval_start(now, self.period) + self.period
+        self._arm(now)
+
+    def stop(self):
+        """Cancel the pending timer"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def set_period(self, period):
+        """Change the interval length, effective from the next boundary of the new period"""
+        if period == self.period:
+            return
+        self.period = period
+        if self._loop is not None:
+            self.stop()
+            self.start(self._loop)
+
+    def _arm(self, now):
+        delay = max(0.0, self._next - now)
+        self._handle = self._loop.call_at(self._loop.time() + delay, self._fire)
+
+    def _fire(self):
+        now = time.time()
+        if now < self._next:
+            # Monotonic and wall clocks disagree slightly, wait out the rest
+            self._arm(now)
+            return
+        boundary = self._next
+        self._next = boundary + self.period
+        if self._next <= now:
+            # Boundaries passed while the loop was blocked or the host was
+            # suspended; resume from the current interval
+            boundary = interval_start(now, self.period)
+            self._next = boundary + self.period
+        self.lag = now - boundary
+        self._arm(now)
+        self.callback(boundary)
@@ -0,0 +1,161 @@
+"""
+This module reconnects to a Parsivel2 whose serial port went away
+
+A USB serial adapter that is reset, unplugged or re-enumerated after a
+reboot of its hub may come back under a different name, e.g. /dev/ttyUSB1
+becoming /dev/ttyUSB2, so retrying the configured path never succeeds. The
+adapter's identity (USB serial number, or the physical USB port it is
+plugged into) is recorded on every successful connection and saved to a
+small JSON file, so it is also known when the plugin is restarted after the
+adapter was renumbered. Before each connection attempt
+``serial.tools.list_ports`` is scanned for a port with that identity.
+Stable ``/dev/serial/by-id`` paths can be given as the device as well.
+Retries back off exponentially with jitter, so an unplugged instrument is
+not hammered every couple of seconds while a brief glitch is recovered from
+within a second.
+"""
+
+import json
+import os
+import random
+
+
+class Backoff:
+    """
+    Exponential backoff between reconnection attempts
+
+    Parameters
+    ----------
+    minimum : float
+        Delay before the first retry, seconds
+    maximum : float
+        Largest delay between retries, seconds
+    factor : float
+        Growth of the delay after each failed attempt
+    jitter : float
+        Fraction of the delay randomly added or removed, so several
+        instruments on one hub do not retry in lockstep
+    """
+
+    def __init__(self, minimum=0.5, maximum=30.0, factor=2.0, jitter=0.1):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self):
+        """Delay before the next attempt, seconds"""
+        delay = min(self.maximum, self.minimum * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def reset(self):
+        """Start over after a successful connection"""
+        self.attempts = 0
+
+
+def _comports():
+    """Serial ports currently present, empty if they cannot be listed"""
+    # pyserial is only imported once a port is actually needed
+    from serial.tools import list_ports  # pylint: disable=import-outside-toplevel
+    try:
+        return list_ports.comports()
+    except OSError:
+        return []
+
+
+def port_identity(device):
+    """
+    Identity of the USB adapter behind a serial device
+
+    Parameters
+    ----------
+    device : str
+        Serial port path, symbolic links such as /dev/serial/by-id are resolved
+
+    Output
+    ------
+    identity : tuple or None
+        ("serial_number", value) or ("location", value), None if the port is
+        not a USB adapter that can be recognised again
+    """
+    path = os.path.realpath(device)
+    for port in _comports():
+        if port.device != path:
+            continue
+        if port.serial_number:
+            return ("serial_number", port.serial_number)
+        if port.location:
+            return ("location", port.location)
+    return None
+
+
+def find_port(identity):
+    """
+    Current device path of the adapter with a known identity
+
+    Parameters
+    ----------
+    identity : tuple
+        Identity from ``port_identity``
+
+    Output
+    ------
+    device : str or None
+        Device path, None if no such adapter is present
+    """
+    key, value = identity
+    for port in _comports():
+        if getattr(port, key) == value:
+            return port.device
+    return None
+
+
+def load_identity(path, device):
+    """
+    Identity saved for a configured serial device
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        JSON file the identities are saved to
+    device : str
+        Serial port as configured on the command line
+
+    Output
+    ------
+    identity : tuple or None
+        Identity from ``port_identity``, None if none was saved
+    """
+    try:
+        with open(path, encoding="utf-8") as ports:
+            identity = json.load(ports).get(device)
+    except (OSError, ValueError):
+        return None
+    return tuple(identity) if identity else None
+
+
+def save_identity(path, device, identity):
+    """
+    Save the identity of the adapter found at a configured serial device
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        JSON file the identities are saved to, replaced atomically
+    device : str
+        Serial port as configured on the command line
+    identity : tuple
+        Identity from ``port_identity``
+    """
+    try:
+        with open(path, encoding="utf-8") as ports:
+            identities = json.load(ports)
+    except (OSError, ValueError):
+        identities = {}
+    identities[device] = list(identity)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as ports:
+        json.dump(identities, ports)
+    os.replace(tmp, path)
@@ -0,0 +1,138 @@
+"""
+This module assembles complete Parsivel2 telegrams from a serial byte stream
+
+``ser.readlines()`` returns whatever lines happen to arrive before the read
+timeout, which splits long telegrams across reads and can deliver several
+telegrams at once. ``TelegramReader`` instead accumulates raw bytes in a
+reusable buffer and only yields a record once its terminator has arrived, so
+no telegram is lost or truncated regardless of how the bytes are chunked.
+
+Each telegram is paired with the time its first byte arrived. A full
+telegram takes about 2.5 s to transmit at 19200 baud, so this is closer to
+the end of the instrument's sampling interval than the time it is parsed.
+"""
+
+import time
+
+# A full telegram including %90/%91/%93 is roughly 5 kB
+MAX_FRAME_SIZE = 16384
+
+
+class TelegramReader:
+    """
+    Streaming record assembler for a serial connection
+
+    Parameters
+    ----------
+    ser : serial.Serial
+        Open serial connection, read with its configured timeout
+    terminator : bytes
+        Sequence marking the end of a telegram
+    max_size : int
+        Largest frame to accept; longer runs without a terminator are dropped
+    gap_timeout : float
+        Seconds without new bytes after which a partially received telegram
+        is discarded rather than joined to the next one
+
+    Attributes
+    ----------
+    frames : int
+        Complete telegrams yielded
+    partial : int
+        Incomplete telegrams discarded after a gap in the byte stream
+    dropped : int
+        Oversized runs of bytes discarded for lacking a terminator
+    """
+
+    def __init__(self, ser, terminator=b"\r\n", max_size=MAX_FRAME_SIZE,
+                 gap_timeout=5.0):
+        self.ser = ser
+        self.terminator = terminator
+        self.max_size = max_size
+        self.gap_timeout = gap_timeout
+        self.frames = 0
+        self.partial = 0
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._arrival = 0.0
+        self._last_byte = time.monotonic()
+
+    def read(self):
+        """
+        Read available bytes from the serial port
+
+        Output
+        ------
+        frames : generator (tuple)
+            (telegram without its terminator, arrival time) pairs, see ``feed``
+        """
+        data = self.ser.read(max(1, self.ser.in_waiting))
+        return self.feed(data)
+
+    def feed(self, data, now=None, received=None):
+        """
+        Add raw bytes to the buffer and yield any completed telegrams
+
+        Parameters
+        ----------
+        data : bytes
+            Bytes received from the instrument, of any length
+        now : float, optional
+            Monotonic time the bytes were received
+        received : float, optional
+            Wall clock time the bytes were received, seconds since the epoch
+
+        Output
+        ------
+        frames : generator (tuple)
+            (telegram without its terminator, arrival time) pairs, where the
+            arrival time is the wall clock time its first byte was received
+        """
+        now = time.monotonic() if now is None else now
+        received = time.time() if received is None else received
+        if self._buffer and now - self._last_byte > self.gap_timeout:
+            self.partial += 1
+            self._reset()
+        if not data:
+            return
+        self._last_byte = now
+        buf = self._buffer
+        if not buf:
+            self._arrival = received
+        buf.extend(data)
+        term = self.terminator
+        while True:
+            # Resume the search where the last one ended, allowing for a
+            # terminator split across reads
+            idx = buf.find(term, max(0, self._scanned - len(term) + 1))
+            if idx < 0:
+                self._scanned = len(buf)
+                if len(buf) > self.max_size:
+                    self.dropped += 1
+                    self._reset()
+                return
+            frame = bytes(buf[:idx])
+            arrival = self._arrival
+            del buf[:idx + len(term)]
+            self._scanned = 0
+            # Any remaining bytes start the next telegram and came with this read
+            self._arrival = received
+            if frame.strip():
+                self.frames += 1
+                yield frame, arrival
+
+    @property
+    def pending_since(self):
+        """Arrival time of the telegram being received, None between telegrams"""
+        return self._arrival if self._buffer else None
+
+    def stats(self):
+        """Summary of the frame counters"""
+        return {"frames": self.frames,
+                "partial": self.partial,
+                "dropped": self.dropped}
+
+    def _reset(self):
+        self._buffer.clear()
+        self._scanned = 0
@@ -0,0 +1,330 @@
+"""
+This module simulates an OTT Parsivel2 so the plugin can run without hardware
+
+Telegrams are generated for any telegram made of the fields in
+``telegram.FIELDS``, formatted the way the instrument sends them, including
+full %90/%91/%93 payloads. Rain comes in events that start and stop at
+random; during an event the drop spectrum is sampled from a Marshall-Palmer
+distribution with drops falling near their terminal velocity, and the
+scalar fields (%01, %07, %11 ...) are derived from that spectrum so products
+and quality control see consistent data.
+
+The simulated clock advances by the instrument interval with every
+telegram, while telegrams are sent at ``--rate`` per second, so days of data
+can be replayed in minutes.
+
+Example, serve the plugin over a pseudo-terminal:
+python simulator.py --site adm --rate 10
+python app.py --device /dev/pts/N --site adm
+"""
+
+import argparse
+import os
+import time
+import tty
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from products import (DIAMETER_CENTERS, DIAMETER_WIDTHS, EFFECTIVE_AREA,
+                      VELOCITY_CENTERS, VELOCITY_WIDTHS, spectrum_nd, terminal_velocity)
+from telegram import FIELDS, define_telegram, telegram_codes
+
+VELOCITY_EDGES = np.append(VELOCITY_CENTERS - VELOCITY_WIDTHS / 2,
+                           VELOCITY_CENTERS[-1] + VELOCITY_WIDTHS[-1] / 2)
+
+
+def _fixed(value, width, precision):
+    """Zero padded fixed point, as the instrument formats its values"""
+    return f"{value:0{width}.{precision}f}"
+
+
+class Simulator:
+    """
+    Generator of realistic Parsivel2 telegrams
+
+    Parameters
+    ----------
+    codes : list (str)
+        Telegram field codes, in the order the instrument sends them
+    interval : int
+        Sampling interval of the simulated instrument in seconds
+    seed : int, optional
+        Seed of the random generator, for reproducible runs
+    rain_onset : float
+        Probability that rain starts in a dry interval
+    rain_end : float
+        Probability that rain stops in a rainy interval
+    start : datetime, optional
+        Time of the first telegram, now by default
+    serial_number : str
+        Reported sensor serial number
+    """
+
+    def __init__(self, codes, interval=60, seed=None, rain_onset=0.02, rain_end=0.05,
+                 start=None, serial_number="450994"):
+        unknown = [code for code in codes if code not in FIELDS]
+        if unknown:
+            raise ValueError(f"Cannot simulate telegram fields: {unknown}")
+        self.codes = list(codes)
+        self.interval = interval
+        self.rain_onset = rain_onset
+        self.rain_end = rain_end
+        self.serial_number = serial_number
+        self.time = start or datetime.now(timezone.utc)
+        self.rng = np.random.default_rng(seed)
+        self.rain_rate = 0.0
+        self.accumulated = 0.0
+        self._expected_velocity = terminal_velocity(DIAMETER_CENTERS)
+
+    def _update_weather(self):
+        """Advance the rain event state and intensity by one interval"""
+        if self.rain_rate > 0:
+            if self.rng.random() < self.rain_end:
+                self.rain_rate = 0.0
+            else:
+                # Log-normal random walk of the rain rate
+                self.rain_rate = float(np.clip(
+                    self.rain_rate * np.exp(self.rng.normal(0.0, 0.3)), 0.1, 150.0))
+        elif self.rng.random() < self.rain_onset:
+            self.rain_rate = float(self.rng.lognormal(0.5, 0.8))
+
+    def spectrum(self):
+        """
+        Sample the drop counts of one interval
+
+        Output
+        ------
+        counts : numpy.ndarray (int16)
+            Drop counts, (diameter, velocity)
+        """
+        counts = np.zeros((32, 32), dtype=np.int16)
+        if self.rain_rate <= 0:
+            return counts
+        # Marshall-Palmer N(D) = N0 exp(-Lambda D), 1/(m3 mm)
+        slope = 4.1 * self.rain_rate ** -0.21
+        nd = 8000.0 * np.exp(-slope * DIAMETER_CENTERS)
+        expected = (nd * self._expected_velocity * EFFECTIVE_AREA
+                    * self.interval * DIAMETER_WIDTHS)
+        # The two smallest classes are below the detection limit
+        expected[:2] = 0.0
+        ndrops = self.rng.poisson(expected)
+        for diameter in np.flatnonzero(ndrops):
+            speed = self._expected_velocity[diameter]
+            velocity = self.rng.normal(speed, 0.1 * speed, size=ndrops[diameter])
+            classes = np.searchsorted(VELOCITY_EDGES, velocity, side="right") - 1
+            classes = classes[(classes >= 0) & (classes < 32)]
+            counts[diameter] = np.bincount(classes, minlength=32)
+        # Counts are three digit fields on the wire
+        return np.minimum(counts, 999)
+
+    def _values(self, counts):
+        """Field code -> value of each simulated field for one interval"""
+        total = int(counts.sum())
+        nd = spectrum_nd(counts, self.interval)
+        per_class = counts.sum(axis=1)
+        mean_velocity = np.where(
+            per_class > 0, (counts * VELOCITY_CENTERS).sum(axis=1) / np.maximum(per_class, 1), 0.0)
+        rain_rate = float(6e-4 * np.pi * (per_class * DIAMETER_CENTERS ** 3
+                                          / EFFECTIVE_AREA).sum() / self.interval)
+        self.accumulated += rain_rate * self.interval / 3600.0
+        m6 = float((nd * DIAMETER_CENTERS ** 6 * DIAMETER_WIDTHS).sum())
+        if rain_rate <= 0:
+            synop = 0
+        elif rain_rate < 2.5:
+            synop = 61
+        elif rain_rate < 7.6:
+            synop = 63
+        else:
+            synop = 65
+        temperature = 20.0 + self.rng.normal(0.0, 0.5)
+        return {
+            "%01": _fixed(rain_rate, 8, 3),
+            "%02": _fixed(self.accumulated, 7, 2),
+            "%03": f"{synop:02d}",
+            "%07": _fixed(10 * np.log10(m6), 6, 3) if m6 > 0 else "-9.999",
+            "%08": f"{int(20000 / (1 + rain_rate)):05d}",
+            "%10": f"{int(self.rng.normal(15000, 50)):05d}",
+            "%11": f"{total:05d}",
+            "%12": f"{int(round(temperature + 2)):03d}",
+            "%13": self.serial_number,
+            "%16": _fixed(0.0, 4, 2),
+            "%17": _fixed(23.9 + self.rng.normal(0.0, 0.05), 4, 1),
+            "%18": "0",
+            "%20": self.time.strftime("%H:%M:%S"),
+            "%21": self.time.strftime("%d.%m.%Y"),
+            "%25": "000",
+            "%27": f"{int(round(temperature)):03d}",
+            "%28": f"{int(round(temperature)):03d}",
+            "%34": _fixed(11.9 * rain_rate, 7, 3),
+            "%60": f"{total + int(self.rng.poisson(0.05 * total)):05d}",
+            "%90": ";".join(_fixed(np.log10(value), 6, 3) if value > 0 else "-9.999"
+                            for value in nd),
+            "%91": ";".join(_fixed(value, 6, 3) for value in mean_velocity),
+            # Velocity-major on the wire
+            "%93": ";".join(f"{value:03d}" for value in counts.T.ravel()),
+        }
+
+    def telegram(self):
+        """
+        Generate the next telegram
+
+        Output
+        ------
+        line : bytes
+            Telegram as sent by the instrument, including its terminator
+        """
+        self._update_weather()
+        values = self._values(self.spectrum())
+        self.time += timedelta(seconds=self.interval)
+        line = ";".join(values[code] for code in self.codes) + ";\r\n"
+        return line.encode("ascii")
+
+    def __iter__(self):
+        while True:
+            yield self.telegram()
+
+
+def _fd_writer(fd):
+    """Write all bytes to a file descriptor"""
+    def write(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    return write
+
+
+def open_port(port=None, baud_rate=19200):
+    """
+    Open the port telegrams are written to
+
+    Parameters
+    ----------
+    port : str, optional
+        Serial port or pyserial URL (e.g. ``loop://``, ``socket://host:port``);
+        a new pseudo-terminal is created when not given
+
+    Output
+    ------
+    write : callable
+        Writes bytes to the port
+    name : str
+        Device name the plugin should read from
+    close : callable
+        Closes the port
+    """
+    if port is None:
+        main_fd, sub_fd = os.openpty()
+        tty.setraw(sub_fd)
+        name = os.ttyname(sub_fd)
+
+        def close():
+            os.close(main_fd)
+            os.close(sub_fd)
+        return _fd_writer(main_fd), name, close
+
+    import serial
+    ser = serial.serial_for_url(port, baudrate=baud_rate)
+    return ser.write, port, ser.close
+
+
+def simulate(simulator, write, rate=1.0, count=None, verbose=False):
+    """
+    Send telegrams at a fixed rate
+
+    Parameters
+    ----------
+    simulator : Simulator
+        Source of telegrams
+    write : callable
+        Writes bytes to the port
+    rate : float
+        Telegrams sent per second
+    count : int, optional
+        Number of telegrams to send, unlimited by default
+    """
+    period = 1.0 / rate
+    deadline = time.monotonic()
+    for sent, line in enumerate(simulator, start=1):
+        write(line)
+        if verbose:
+            print(f"{simulator.time:%Y-%m-%d %H:%M:%S} rain {simulator.rain_rate:6.2f} mm/hr")
+        if count is not None and sent >= count:
+            break
+        deadline += period
+        time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Simulate an OTT Parsivel2 over a pseudo-terminal or serial URL")
+    parser.add_argument("--port",
+                        type=str,
+                        dest="port",
+                        default=None,
+                        help=("[str] Serial Port or pyserial URL to Write to " +
+                              "(default a new pseudo-terminal)")
+                        )
+    parser.add_argument("--site",
+                        type=str,
+                        dest="site",
+                        default="atmos",
+                        help="[str] Site Identifer whose Telegram is Simulated"
+                        )
+    parser.add_argument("--telegram",
+                        type=str,
+                        dest="telegram",
+                        default=None,
+                        help="[str] Telegram to Simulate, Overriding the Site Default"
+                        )
+    parser.add_argument("--rate",
+                        type=float,
+                        dest="rate",
+                        default=1.0,
+                        help="[float] Telegrams Sent per Second"
+                        )
+    parser.add_argument("--count",
+                        type=int,
+                        dest="count",
+                        default=None,
+                        help="[int] Number of Telegrams to Send (default unlimited)"
+                        )
+    parser.add_argument("--interval",
+                        type=int,
+                        dest="interval",
+                        default=60,
+                        help="[int] Simulated Sampling Interval of the Instrument (seconds)"
+                        )
+    parser.add_argument("--rain",
+                        type=float,
+                        dest="rain",
+                        default=0.02,
+                        help="[float] Probability of Rain Starting in a Dry Interval"
+                        )
+    parser.add_argument("--seed",
+                        type=int,
+                        dest="seed",
+                        default=None,
+                        help="[int] Random Seed for Reproducible Telegrams"
+                        )
+    parser.add_argument("--verbose",
+                        action="store_true",
+                        dest="verbose",
+                        help="Print the Simulated Time and Rain Rate of Each Telegram"
+                        )
+    args = parser.parse_args()
+    if args.telegram and os.path.isfile(args.telegram):
+        with open(args.telegram, encoding="ascii") as nfile:
+            args.telegram = nfile.read()
+
+    telegram = define_telegram(args.site, args.telegram)[0]
+    sim = Simulator(telegram_codes(telegram), args.interval, args.seed, args.rain)
+    write, name, close = open_port(args.port)
+    print(f"Simulating Parsivel2 on {name}")
+    try:
+        simulate(sim, write, args.rate, args.count, args.verbose)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
@@ -0,0 +1,137 @@
+"""
+This module encodes the 32x32 Parsivel2 drop spectrum into a short string
+
+Most of the 1024 diameter x velocity classes of a spectrum are empty, so
+only the nonzero classes are kept: the gaps between their flattened
+(diameter-major) indices and their counts, written as LEB128 varints,
+deflated with zlib and base64 encoded so the result can be published as a
+``parsivel.spectrum`` string value. A raining spectrum of a few hundred
+drops encodes to around a hundred characters instead of the ~4 kB of the
+%93 telegram field.
+
+``decode_spectrum`` restores the array, and ``decode_dataframe`` does so for
+every message of a ``sage_data_client.query`` result, e.g.
+
+    df = sage_data_client.query(start="-1h", filter={"name": "parsivel.spectrum"})
+    times, spectra = decode_dataframe(df)
+"""
+
+import base64
+import zlib
+
+import numpy as np
+
+SHAPE = (32, 32)
+# Identifies the format in the message metadata and as the first byte
+ENCODING = "sparse-varint-zlib-base64"
+VERSION = 1
+
+
+def _varints(values):
+    """LEB128 encode non-negative integers, vectorized over 7 bit groups"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not values.size:
+        return b""
+    ngroups = max(1, (int(values.max()).bit_length() + 6) // 7)
+    groups = np.stack([(values >> np.uint64(7 * i)) & np.uint64(0x7F)
+                       for i in range(ngroups)], axis=1).astype(np.uint8)
+    # Bytes of each value up to its most significant nonzero group
+    lengths = np.maximum(1, ngroups - np.argmax(groups[:, ::-1] != 0, axis=1))
+    lengths[~groups.any(axis=1)] = 1
+    keep = np.arange(ngroups)[None, :] < lengths[:, None]
+    more = np.arange(ngroups)[None, :] < (lengths - 1)[:, None]
+    groups[more] |= 0x80
+    return groups[keep].tobytes()
+
+
+def _read_varints(data, count):
+    """Decode ``count`` LEB128 integers from the start of ``data``"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("Truncated spectrum encoding")
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    values = np.zeros(count, dtype=np.int64)
+    for shift in range(int((ends - starts).max(initial=0)) + 1):
+        position = starts + shift
+        valid = position <= ends
+        values[valid] |= (raw[position[valid]].astype(np.int64) & 0x7F) << (7 * shift)
+    return values, int(ends[-1]) + 1 if count else 0
+
+
+def encode_spectrum(spectrum):
+    """
+    Encode a drop spectrum
+
+    Parameters
+    ----------
+    spectrum : numpy.ndarray
+        Non-negative drop counts, (diameter, velocity)
+
+    Output
+    ------
+    encoded : str
+        Base64 text of the compressed sparse spectrum
+    """
+    flat = np.asarray(spectrum).ravel()
+    index = np.flatnonzero(flat)
+    gaps = np.diff(index, prepend=0)
+    payload = (_varints([len(index)]) + _varints(gaps) +
+               _varints(flat[index].astype(np.int64)))
+    return base64.b64encode(bytes([VERSION]) + zlib.compress(payload, 9)).decode("ascii")
+
+
+def decode_spectrum(encoded):
+    """
+    Decode a spectrum produced by ``encode_spectrum``
+
+    Parameters
+    ----------
+    encoded : str
+        Base64 text of the compressed sparse spectrum
+
+    Output
+    ------
+    spectrum : numpy.ndarray (int32)
+        Drop counts, (diameter, velocity)
+    """
+    data = base64.b64decode(encoded)
+    if not data or data[0] != VERSION:
+        raise ValueError("Unsupported spectrum encoding")
+    payload = zlib.decompress(data[1:])
+    (count,), offset = _read_varints(payload, 1)
+    spectrum = np.zeros(SHAPE[0] * SHAPE[1], dtype=np.int32)
+    if count:
+        gaps, used = _read_varints(payload[offset:], count)
+        counts, _ = _read_varints(payload[offset + used:], count)
+        spectrum[np.cumsum(gaps)] = counts
+    return spectrum.reshape(SHAPE)
+
+
+def decode_dataframe(df, name="parsivel.spectrum"):
+    """
+    Decode the spectra of a Beehive query
+
+    Parameters
+    ----------
+    df : Pandas DataFrame
+        ``sage_data_client.query`` result holding ``parsivel.spectrum`` rows
+    name : str
+        Message to decode, e.g. ``parsivel.spectrum.5min`` for aggregates
+
+    Output
+    ------
+    times : numpy.ndarray (datetime64[ms])
+        Time of each spectrum
+    spectra : numpy.ndarray (int32)
+        Drop counts, (time, diameter, velocity)
+    """
+    df = df[df["name"] == name].sort_values("timestamp")
+    timestamps = df["timestamp"]
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert(None)
+    times = timestamps.to_numpy(dtype="datetime64[ms]")
+    spectra = np.zeros((len(df),) + SHAPE, dtype=np.int32)
+    for i, encoded in enumerate(df["value"]):
+        spectra[i] = decode_spectrum(encoded)
+    return times, spectra
@@ -0,0 +1,340 @@
+"""
+This module decodes OTT Parsivel2 telegrams into typed NumPy records
+
+The instrument outputs each telegram as a single ';'-delimited line, where
+the vector fields (%90, %91 and %93) are themselves ';'-delimited lists of
+32, 32 and 1024 values. Rather than carrying every value around as text,
+each line is decoded once into a NumPy structured record whose layout is
+derived from the field codes listed in the site telegram.
+
+Every supported field is described once in the ``FIELDS`` registry, keyed by
+its Parsivel field code. Site telegrams are plain lists of codes, so adding
+a site (or reading the telegram configured on an instrument) needs no new
+code.
+"""
+
+import re
+
+from collections import namedtuple
+from datetime import timezone
+from functools import lru_cache
+
+import numpy as np
+
+Field = namedtuple("Field", ["name", "description", "units", "dtype", "shape", "publish"])
+
+# Registry of every telegram field the plugin knows how to decode, keyed by
+# Parsivel field code: record field name, header description and units,
+# dtype and shape (scalars have an empty shape) and the Beehive parameter
+# name used when the field is published.
+FIELDS = {
+    "%01": Field("rain_intensity", "Rain Intensity", "mm/h",
+                 np.float32, (), "parsivel.rain.intensity"),
+    "%02": Field("rain_accum", "Rain Amount Accumulated", "mm",
+                 np.float32, (), "parsivel.rain.accum"),
+    "%03": Field("weather_code_synop", "Weather Code SYNOP", "#",
+                 np.int16, (), None),
+    "%07": Field("radar_reflectivity", "Radar Reflectivity", "dBz",
+                 np.float32, (), "parsivel.radar"),
+    "%08": Field("mor_visibility", "MOR Visibilty in Precip", "m",
+                 np.int32, (), None),
+    "%10": Field("laser_amplitude", "Signal Amplitude of the laser strip", "#",
+                 np.int32, (), None),
+    "%11": Field("particles_validated", "Number of Particles Detected and Validated", "#",
+                 np.int32, (), None),
+    "%12": Field("sensor_temperature", "Temperature in the Sensor Housing", "degC",
+                 np.float32, (), "parsivel.house.temp"),
+    "%13": Field("serial_number", "Sensor Serial Number", "#",
+                 "U16", (), None),
+    "%16": Field("heating_current", "Sensor Head Heating Current", "A",
+                 np.float32, (), None),
+    "%17": Field("supply_voltage", "Power Supply Voltage", "V",
+                 np.float32, (), "parsivel.house.voltage"),
+    "%18": Field("sensor_status", "Sensor Status", "#",
+                 np.int16, (), "parsivel.house.status"),
+    "%20": Field("sensor_time", "Sensor Time", "hh:mm:ss",
+                 "U8", (), None),
+    "%21": Field("sensor_date", "Sensor Date", "DD.MM.YYYY",
+                 "U10", (), None),
+    "%25": Field("error_code", "Error Code", "#",
+                 np.int16, (), "parsivel.house.error"),
+    "%27": Field("temperature_right", "Temperature in the right sensor head", "degC",
+                 np.float32, (), None),
+    "%28": Field("temperature_left", "Temperature in the left sensor head", "degC",
+                 np.float32, (), None),
+    "%34": Field("kinetic_energy", "Kinetic Energy", "J/(m^2h)",
+                 np.float32, (), None),
+    "%60": Field("particles_detected", "Number of Particles Detected", "#",
+                 np.int32, (), None),
+    "%90": Field("nd", "N(d)", "log10(1/m3 mm)",
+                 np.float32, (32,), None),
+    "%91": Field("vd", "v(d)", "m/s",
+                 np.float32, (32,), None),
+    # %93 is output velocity-major (all 32 diameter classes for velocity
+    # class 1, then velocity class 2, ...); it is stored diameter x velocity.
+    "%93": Field("raw_spectrum", "Raw Data", "#",
+                 np.int16, (32, 32), None),
+}
+
+# Telegrams programmed into the instruments at each site, and the fields
+# published to Beehive separately from the files, in publishing order.
+# Sites not listed here use the factory default telegram.
+FACTORY_TELEGRAM = ("%13;%01;%02;%03;%07;%08;%34;%12;%10;%11;%18;",
+                    "%01;%02;%07;%12;%18")
+SITE_TELEGRAMS = {
+    "adm": ("%13;%21;%20;%18;%25;%17;%16;%27;%28;%12;%01;%02;%07;%11;%60;%90;%91;%93",
+            "%18;%25;%17;%01;%02;%07"),
+    "atmos": ("%13;%21;%20;%18;%25;%17;%16;%27;%28;%12;%01;%02;%07;%11;%60;%90;%91;%93",
+              "%18;%25;%17;%01;%02;%07"),
+}
+# Header (description, units) the sites have always written for some fields,
+# kept so their files do not change; other sites use the wording above
+SITE_LABELS = {
+    "%01": ("Rain Intensity", "mm/hr"),
+    "%07": ("Radar Reflectivity", "dBZ"),
+    "%11": ("Number of Particles Validated", "#"),
+    "%12": ("Sensor Heating Temperature", "degC"),
+    "%13": ("Sensor Serial Num", "#"),
+}
+HEADER_LABELS = {"adm": SITE_LABELS, "atmos": SITE_LABELS}
+# Fields published for a telegram read from the instrument configuration
+DEFAULT_PUBLISH = "%18;%25;%17;%01;%02;%07;%12"
+
+FIELD_CODE = re.compile(r"%\d\d")
+
+
+class TelegramError(ValueError):
+    """Raised when a line does not match the configured telegram"""
+
+
+def telegram_codes(telegram):
+    """
+    Extract the Parsivel field codes from a telegram description
+
+    Parameters
+    ----------
+    telegram : list (str)
+        Parameter descriptions as returned by ``define_telegram``
+
+    Output
+    ------
+    codes : list (str)
+        Field codes (e.g. "%01") in the order they appear in the telegram.
+        Descriptions without a field code (the timestamp) are skipped.
+    """
+    codes = []
+    for description in telegram:
+        match = FIELD_CODE.search(description)
+        if match:
+            codes.append(match.group())
+    return codes
+
+
+def parse_telegram(text):
+    """
+    Field codes of a telegram configuration string
+
+    Parameters
+    ----------
+    text : str
+        Telegram as programmed into the instrument, e.g. "%13;%01;%02;"
+        (the contents of parsivel_telegram.txt)
+
+    Output
+    ------
+    codes : list (str)
+        Field codes in telegram order
+    """
+    codes = FIELD_CODE.findall(text)
+    unknown = [code for code in codes if code not in FIELDS]
+    if unknown:
+        raise TelegramError(f"Unsupported telegram fields: {unknown}")
+    return codes
+
+
+def define_telegram(site, telegram=None):
+    """
+    Fuction to define the telegram for the specific site
+
+    Parameters
+    ----------
+    site : str
+        Site Identifier to specify instrument configuration
+    telegram : str, optional
+        Telegram configured on the instrument, overriding the site default
+
+    Output
+    ------
+    telegram : list (str)
+        Parameter descriptions for the instrument configuration
+    telegram_units : list (str)
+        Parameter units for the instrument configuration
+    publish_list : list (int)
+        Integers of parameters to keep to publish to beehive separately from
+        the csv files.
+    publish_parms : list (str)
+        Short names of parameters to publish to beehive.
+    """
+    default, publish = SITE_TELEGRAMS.get(site.lower(), FACTORY_TELEGRAM)
+    codes = parse_telegram(telegram or default)
+    if telegram:
+        # Publish whichever of the usual parameters the telegram carries
+        publish = DEFAULT_PUBLISH
+
+    labels = HEADER_LABELS.get(site.lower(), {})
+    telegram = ["Timestamp (UTC)"]
+    telegram_units = ["YYYY-MM-DDTHH:MM:SS.fff"]
+    for code in codes:
+        description, units = labels.get(code, (FIELDS[code].description, FIELDS[code].units))
+        telegram.append(f"\t{description} ({code})")
+        telegram_units.append(f"\t{units}")
+    publish_list = [codes.index(code) + 1 for code in parse_telegram(publish)
+                    if code in codes]
+    publish_parms = [FIELDS[codes[parm - 1]].publish for parm in publish_list]
+
+    return telegram, telegram_units, publish_list, publish_parms
+
+
+@lru_cache(maxsize=None)
+def compile_decoder(codes, extra=()):
+    """
+    Compiled decoder for a telegram, built once per telegram and reused
+
+    Parameters
+    ----------
+    codes : tuple (str)
+        Telegram field codes
+    extra : tuple (tuple), optional
+        Additional (name, dtype, shape) record fields
+    """
+    return TelegramDecoder(list(codes), extra)
+
+
+def _assign(record, name, shape, values):
+    """Store flat telegram values into a (possibly 2-D) record field"""
+    if len(shape) == 2:
+        # Velocity-major on the wire, diameter x velocity in the record
+        values = values.reshape(shape[::-1]).T
+    record[name] = values
+
+
+class TelegramDecoder:
+    """
+    Decode Parsivel2 telegram lines into NumPy structured records
+
+    The decoding plan is compiled once from the telegram so that each line is
+    handled in a single pass: the leading scalar fields are split off
+    individually and the trailing run of vector fields is converted in bulk
+    with ``np.fromstring``.
+
+    Parameters
+    ----------
+    telegram : list (str)
+        Parameter descriptions as returned by ``define_telegram``
+    extra : list (tuple), optional
+        Additional (name, dtype, shape) fields appended to each record and
+        filled in by later processing stages, e.g. quality control
+    """
+
+    def __init__(self, telegram, extra=()):
+        self.codes = telegram_codes(telegram)
+        unknown = [code for code in self.codes if code not in FIELDS]
+        if unknown:
+            raise TelegramError(f"Unsupported telegram fields: {unknown}")
+        fields = [FIELDS[code] for code in self.codes]
+        self.names = [field.name for field in fields]
+        self.dtype = np.dtype([("time", "datetime64[ms]")] +
+                              [(field.name, field.dtype, field.shape) for field in fields] +
+                              list(extra))
+
+        # Split the telegram into scalar fields that precede the vector block
+        # and the vector block itself, which is decoded with one bulk call.
+        # Vector fields are only bulk converted if they are trailing, which
+        # is how the instrument is configured at every deployment; otherwise
+        # they are handled token by token alongside the scalars.
+        ntail = 0
+        for code in reversed(self.codes):
+            if FIELDS[code].shape == ():
+                break
+            ntail += 1
+        self._head = []
+        start = 0
+        for code in self.codes[:len(self.codes) - ntail]:
+            name, shape = FIELDS[code].name, FIELDS[code].shape
+            count = int(np.prod(shape)) if shape else 1
+            self._head.append((name, start, count, shape))
+            start += count
+        self._nhead = start
+        self._tail = []
+        offset = 0
+        for code in self.codes[len(self.codes) - ntail:]:
+            name, shape = FIELDS[code].name, FIELDS[code].shape
+            count = int(np.prod(shape))
+            self._tail.append((name, offset, count, shape))
+            offset += count
+        self._ntail = offset
+        # When the leading fields are all scalars they are assigned with a
+        # single multi-field assignment rather than field by field
+        self._scalars = None
+        if all(not shape for _, _, _, shape in self._head):
+            self._scalars = [name for name, _, _, _ in self._head]
+
+    def empty(self, size=1):
+        """Preallocate an array of ``size`` empty records"""
+        return np.zeros(size, dtype=self.dtype)
+
+    def decode(self, line, timestamp=None, out=None):
+        """
+        Decode a single telegram line
+
+        Parameters
+        ----------
+        line : str or bytes
+            Telegram line as read from the serial port
+        timestamp : numpy.datetime64 or datetime, optional
+            Time the record was received, stored in the ``time`` field
+        out : numpy.ndarray, optional
+            Preallocated single element record array to decode into
+
+        Output
+        ------
+        record : numpy.void
+            Structured record with one field per telegram entry
+        """
+        if isinstance(line, (bytes, bytearray)):
+            line = line.decode("ascii", errors="replace")
+        line = line.strip()
+        if out is None:
+            out = self.empty()
+        record = out[0]
+        if timestamp is not None:
+            if getattr(timestamp, "tzinfo", None) is not None:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+            record["time"] = np.datetime64(timestamp, "ms")
+
+        parts = line.split(";", self._nhead)
+        if len(parts) < self._nhead + (1 if self._tail else 0):
+            raise TelegramError(
+                f"Expected {self._nhead} leading fields, got {len(parts)}")
+        try:
+            if self._scalars is not None:
+                out[self._scalars][0] = tuple(parts[:self._nhead])
+            else:
+                for name, start, count, shape in self._head:
+                    if shape:
+                        _assign(record, name, shape,
+                                np.array(parts[start:start + count], dtype=np.float32))
+                    else:
+                        record[name] = parts[start]
+            if self._tail:
+                values = np.fromstring(parts[-1], dtype=np.float32, sep=";")
+                if values.size != self._ntail:
+                    raise TelegramError(
+                        f"Expected {self._ntail} vector values, got {values.size}")
+                for name, offset, count, shape in self._tail:
+                    _assign(record, name, shape, values[offset:offset + count])
+        except (ValueError, TypeError) as err:
+            if isinstance(err, TelegramError):
+                raise
+            raise TelegramError(f"Could not decode telegram: {err}") from err
+        return record
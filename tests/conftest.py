@@ -0,0 +1,23 @@
+"""
+Shared test setup
+
+The plugin modules live at the top of the repository rather than in a
+package, so the repository root is put on the import path.
+"""
+
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def wait_until(condition, timeout=5.0):
+    """Poll ``condition`` until it is true or ``timeout`` seconds pass"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
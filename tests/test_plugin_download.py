@@ -0,0 +1,135 @@
+"""Tests of the resumable file download against a local HTTP server"""
+
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("sage_data_client")
+
+import plugin_download  # noqa: E402
+
+from plugin_download import make_session, query_uploads, readtofile  # noqa: E402
+
+CONTENT = bytes(range(256)) * 64
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves CONTENT at /file.csv with HEAD, Range and If-Range support"""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length, extra=()):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", ETAG)
+        for key, value in extra:
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        Handler.requests.append(("HEAD", self.path, None))
+        if self.path != "/file.csv":
+            self._headers(404, 0)
+            return
+        self._headers(200, len(CONTENT))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        byte_range = self.headers.get("Range")
+        Handler.requests.append(("GET", self.path, byte_range))
+        if self.path != "/file.csv":
+            self._headers(404, 0)
+            return
+        if byte_range and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(byte_range.split("=")[1].rstrip("-"))
+            body = CONTENT[start:]
+            self._headers(206, len(body),
+                          [("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")])
+        else:
+            body = CONTENT
+            self._headers(200, len(body))
+        self.wfile.write(body)
+
+
+@pytest.fixture(name="server")
+def fixture_server():
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(name="session")
+def fixture_session():
+    with make_session(SimpleNamespace(user="user", password="password", workers=1)) as session:
+        yield session
+
+
+def test_download(server, session, tmp_path):
+    fname = str(tmp_path / "file.csv")
+    assert readtofile(session, server + "/file.csv", fname) == ("downloaded", len(CONTENT))
+    assert (tmp_path / "file.csv").read_bytes() == CONTENT
+    assert not (tmp_path / "file.csv.part").exists()
+
+
+def test_missing_file(server, session, tmp_path):
+    fname = str(tmp_path / "missing.csv")
+    assert readtofile(session, server + "/missing.csv", fname) == ("failed", 0)
+    assert not (tmp_path / "missing.csv").exists()
+
+
+def test_resume_partial_download(server, session, tmp_path):
+    fname = str(tmp_path / "file.csv")
+    (tmp_path / "file.csv.part").write_bytes(CONTENT[:1000])
+    (tmp_path / "file.csv.etag").write_text(ETAG)
+    status, nbytes = readtofile(session, server + "/file.csv", fname)
+    assert (status, nbytes) == ("downloaded", len(CONTENT) - 1000)
+    assert ("GET", "/file.csv", "bytes=1000-") in Handler.requests
+    assert (tmp_path / "file.csv").read_bytes() == CONTENT
+    assert not (tmp_path / "file.csv.etag").exists()
+
+
+def test_changed_file_restarts(server, session, tmp_path):
+    fname = str(tmp_path / "file.csv")
+    (tmp_path / "file.csv.part").write_bytes(b"x" * 1000)
+    (tmp_path / "file.csv.etag").write_text('"old"')
+    assert readtofile(session, server + "/file.csv", fname) == ("downloaded", len(CONTENT))
+    assert (tmp_path / "file.csv").read_bytes() == CONTENT
+
+
+def test_complete_file_is_skipped(server, session, tmp_path):
+    fname = str(tmp_path / "file.csv")
+    (tmp_path / "file.csv").write_bytes(CONTENT)
+    assert readtofile(session, server + "/file.csv", fname) == ("skipped", 0)
+    assert [method for method, _, _ in Handler.requests] == ["HEAD"]
+
+
+def test_query_matches_compressed_uploads(monkeypatch):
+    filters = []
+
+    def query(start, end, filter):  # pylint: disable=redefined-builtin
+        filters.append(filter)
+        return []
+
+    monkeypatch.setattr(plugin_download.sage_data_client, "query", query)
+    args = SimpleNamespace(node="W09A", plugin="parsivel", extension="csv", chunk_days=1,
+                           start_date="2024-05-01T00:00:00Z", end_date="2024-05-02T00:00:00Z")
+    assert not list(query_uploads(args))
+    pattern = filters[0]["filename"]
+    for name in ["adm.parsivel2.20240501.000000.csv",
+                 "adm.parsivel2.20240501.000000.csv.gz",
+                 "adm.parsivel2.20240501.000000.csv.zst"]:
+        assert re.fullmatch(pattern, name)
+    for name in ["adm.parsivel2.20240501.000000.nc", "adm.parsivel2.csv.tmp", "notes.xcsv"]:
+        assert not re.fullmatch(pattern, name)
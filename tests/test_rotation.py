@@ -0,0 +1,143 @@
+"""Tests of routing telegrams that straddle a file boundary"""
+
+import asyncio
+
+from argparse import Namespace
+
+import pytest
+
+import app
+
+from app import Instrument
+from simulator import Simulator
+from telegram import define_telegram, telegram_codes
+from writers import read_csv
+
+# A 5 minute boundary, seconds since the epoch
+BOUNDARY = 1500.0
+
+
+class Uploads:
+    """Stand-in for ``UploadQueue`` recording the submitted files"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, path):
+        self.submitted.append(path.name)
+
+
+def make_args(outdir, **options):
+    args = Namespace(verbose=False, publish=False, publish_spectrum=False, publish_batch=1,
+                     products=False, interval=60, qc=False, qc_tolerance=0.5, aggregate=[],
+                     aggregate_only=False, reconnect_min=0.5, reconnect_max=30.0,
+                     baud_rate=19200, output="csv", compress=None, journal_records=1, freq=5,
+                     adaptive=False, dry_freq=60, rain_threshold=0.1, rain_particles=10,
+                     dry_after=30, telegram=None, cache_hours=0, cache_dir=None,
+                     outdir=str(outdir))
+    for key, value in options.items():
+        setattr(args, key, value)
+    return args
+
+
+@pytest.fixture(name="telegrams")
+def fixture_telegrams():
+    codes = telegram_codes(define_telegram("atmos", None)[0])
+    return iter(Simulator(codes, seed=1, rain_onset=1.0))
+
+
+def feed(instrument, data, received):
+    """Deliver bytes from the serial port, handling the telegrams they complete"""
+    for frame, arrival in list(instrument.reader.feed(data, received=received)):
+        instrument.handle(frame, arrival)
+
+
+async def settle(instrument):
+    """Wait for the files being retired in the background"""
+    while instrument._tasks:  # pylint: disable=protected-access
+        await asyncio.gather(*list(instrument._tasks))  # pylint: disable=protected-access
+
+
+def records_in(outdir, start):
+    name = f"atmos.parsivel2.19700101.{start // 3600:02.0f}{start % 3600 // 60:02.0f}00.csv"
+    return read_csv(outdir / name)["time"].astype("datetime64[ms]").astype("i8") / 1000
+
+
+def test_straddling_telegram_goes_to_its_interval(tmp_path, telegrams):
+    uploads = Uploads()
+    instrument = Instrument("/dev/null", "atmos", make_args(tmp_path), None, uploads)
+
+    async def scenario():
+        instrument.open_file(BOUNDARY - 300)
+        feed(instrument, next(telegrams), BOUNDARY - 30)
+        # The next telegram starts arriving before the boundary
+        line = next(telegrams)
+        feed(instrument, line[:1000], BOUNDARY - 1)
+        instrument.rotate(BOUNDARY)
+        await settle(instrument)
+        assert not uploads.submitted
+        feed(instrument, line[1000:], BOUNDARY + 1.5)
+        feed(instrument, next(telegrams), BOUNDARY + 30)
+        await settle(instrument)
+        instrument.writer.close()
+
+    asyncio.run(scenario())
+    assert uploads.submitted == ["atmos.parsivel2.19700101.002000.csv"]
+    assert list(records_in(tmp_path, BOUNDARY - 300)) == [BOUNDARY - 30, BOUNDARY - 1]
+    assert list(records_in(tmp_path, BOUNDARY)) == [BOUNDARY + 30]
+
+
+def test_straddling_file_closed_after_timeout(tmp_path, telegrams, monkeypatch):
+    monkeypatch.setattr(app, "STRADDLE_TIMEOUT", 0.05)
+    uploads = Uploads()
+    instrument = Instrument("/dev/null", "atmos", make_args(tmp_path), None, uploads)
+
+    async def scenario():
+        instrument.open_file(BOUNDARY - 300)
+        feed(instrument, next(telegrams), BOUNDARY - 30)
+        # A telegram cut off by the instrument is never completed
+        feed(instrument, next(telegrams)[:1000], BOUNDARY - 1)
+        instrument.rotate(BOUNDARY)
+        await asyncio.sleep(0.2)
+        await settle(instrument)
+        assert uploads.submitted == ["atmos.parsivel2.19700101.002000.csv"]
+        instrument.writer.close()
+
+    asyncio.run(scenario())
+    assert list(records_in(tmp_path, BOUNDARY - 300)) == [BOUNDARY - 30]
+
+
+def test_rotation_without_pending_telegram(tmp_path, telegrams):
+    uploads = Uploads()
+    instrument = Instrument("/dev/null", "atmos", make_args(tmp_path), None, uploads)
+
+    async def scenario():
+        instrument.open_file(BOUNDARY - 300)
+        feed(instrument, next(telegrams), BOUNDARY - 30)
+        instrument.rotate(BOUNDARY)
+        await settle(instrument)
+        assert uploads.submitted == ["atmos.parsivel2.19700101.002000.csv"]
+        feed(instrument, next(telegrams), BOUNDARY + 30)
+        instrument.writer.close()
+
+    asyncio.run(scenario())
+    assert list(records_in(tmp_path, BOUNDARY)) == [BOUNDARY + 30]
+
+
+def test_undecodable_straddling_telegram(tmp_path, telegrams):
+    uploads = Uploads()
+    instrument = Instrument("/dev/null", "atmos", make_args(tmp_path), None, uploads)
+
+    async def scenario():
+        instrument.open_file(BOUNDARY - 300)
+        feed(instrument, b"450994;garbled", BOUNDARY - 1)
+        instrument.rotate(BOUNDARY)
+        feed(instrument, b"\r\n", BOUNDARY + 1)
+        await settle(instrument)
+        assert uploads.submitted == ["atmos.parsivel2.19700101.002000.csv"]
+        instrument.writer.close()
+
+    asyncio.run(scenario())
+    rows = (tmp_path / "atmos.parsivel2.19700101.002000.csv").read_text().splitlines()
+    assert rows[-1] == "1970-01-01T00:24:59.000;450994;garbled"
+    assert instrument.metrics.counters["malformed"] == 1
@@ -0,0 +1,102 @@
+"""Tests of file rotation on aligned interval boundaries"""
+
+import pytest
+
+import scheduler
+
+from scheduler import RotationScheduler, interval_start
+
+
+class Clock:
+    """Wall clock and event loop stand-in, timers run only when fired by the test"""
+
+    def __init__(self, now):
+        self.now = now
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        timer = Timer(when, callback)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self, now):
+        """Advance the wall clock and run the pending timer"""
+        self.now = now
+        timer = self.timers[-1]
+        assert not timer.cancelled
+        timer.callback()
+
+
+class Timer:
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    clock = Clock(1000.5)
+    monkeypatch.setattr(scheduler.time, "time", clock.time)
+    return clock
+
+
+def test_interval_start():
+    assert interval_start(1000.5, 300) == 900
+    assert interval_start(1200, 300) == 1200
+
+
+def test_boundaries_are_aligned(clock):
+    boundaries = []
+    rotation = RotationScheduler(300, boundaries.append)
+    rotation.start(clock)
+    assert rotation.next_boundary == 1200
+    assert clock.timers[-1].when == pytest.approx(1200)
+    clock.fire(1200.25)
+    assert boundaries == [1200]
+    assert rotation.lag == pytest.approx(0.25)
+    # The next boundary follows the previous one, not the late callback
+    assert rotation.next_boundary == 1500
+    assert clock.timers[-1].when == pytest.approx(1500)
+
+
+def test_early_timer_waits_for_boundary(clock):
+    boundaries = []
+    rotation = RotationScheduler(300, boundaries.append)
+    rotation.start(clock)
+    clock.fire(1199.9)
+    assert not boundaries
+    assert rotation.next_boundary == 1200
+    clock.fire(1200.0)
+    assert boundaries == [1200]
+
+
+def test_missed_boundaries_catch_up(clock):
+    boundaries = []
+    rotation = RotationScheduler(300, boundaries.append)
+    rotation.start(clock)
+    # The loop was blocked (or the host suspended) across several boundaries
+    clock.fire(2150.0)
+    assert boundaries == [2100]
+    assert rotation.lag == pytest.approx(50.0)
+    assert rotation.next_boundary == 2400
+    clock.fire(2400.0)
+    assert boundaries == [2100, 2400]
+
+
+def test_set_period(clock):
+    boundaries = []
+    rotation = RotationScheduler(300, boundaries.append)
+    rotation.start(clock)
+    first = clock.timers[-1]
+    rotation.set_period(3600)
+    assert first.cancelled
+    assert rotation.next_boundary == 3600
+    rotation.stop()
+    assert clock.timers[-1].cancelled
@@ -0,0 +1,48 @@
+"""Tests of finding a renumbered serial adapter again"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import serial_ports
+
+from serial_ports import Backoff, find_port, load_identity, port_identity, save_identity
+
+
+@pytest.fixture(name="ports")
+def fixture_ports(monkeypatch):
+    ports = []
+    monkeypatch.setattr(serial_ports, "_comports", lambda: ports)
+    return ports
+
+
+def _port(device, serial_number=None, location=None):
+    return SimpleNamespace(device=device, serial_number=serial_number, location=location)
+
+
+def test_identity_follows_renumbered_adapter(ports):
+    ports.append(_port("/dev/ttyUSB1", serial_number="A1"))
+    identity = port_identity("/dev/ttyUSB1")
+    assert identity == ("serial_number", "A1")
+    ports[:] = [_port("/dev/ttyUSB0", location="1-1.2"), _port("/dev/ttyUSB2", "A1")]
+    assert find_port(identity) == "/dev/ttyUSB2"
+    assert port_identity("/dev/ttyUSB0") == ("location", "1-1.2")
+    assert port_identity("/dev/ttyUSB1") is None
+
+
+def test_saved_identity(tmp_path):
+    path = tmp_path / "ports.json"
+    assert load_identity(path, "/dev/ttyUSB1") is None
+    save_identity(path, "/dev/ttyUSB1", ("serial_number", "A1"))
+    save_identity(path, "/dev/ttyUSB5", ("location", "1-1.3"))
+    assert load_identity(path, "/dev/ttyUSB1") == ("serial_number", "A1")
+    assert load_identity(path, "/dev/ttyUSB5") == ("location", "1-1.3")
+    path.write_text("{")
+    assert load_identity(path, "/dev/ttyUSB1") is None
+
+
+def test_backoff():
+    backoff = Backoff(minimum=1, maximum=5, jitter=0)
+    assert [backoff.next() for _ in range(5)] == [1, 2, 4, 5, 5]
+    backoff.reset()
+    assert backoff.next() == 1
@@ -0,0 +1,77 @@
+"""Tests of telegram framing from a chunked serial byte stream"""
+
+from serial_reader import TelegramReader
+
+
+def _feed(reader, data, now=0.0, received=100.0):
+    return list(reader.feed(data, now=now, received=received))
+
+
+def test_telegram_split_across_reads():
+    reader = TelegramReader(None)
+    assert not _feed(reader, b"01:0000.000;02:", now=0.0, received=100.0)
+    assert not _feed(reader, b"0000.00;\r", now=0.5, received=100.5)
+    assert _feed(reader, b"\n", now=1.0, received=101.0) == [
+        (b"01:0000.000;02:0000.00;", 100.0)]
+    assert reader.frames == 1
+
+
+def test_several_telegrams_in_one_read():
+    reader = TelegramReader(None)
+    frames = _feed(reader, b"first\r\nsecond\r\nthi", received=100.0)
+    assert frames == [(b"first", 100.0), (b"second", 100.0)]
+    assert _feed(reader, b"rd\r\n", now=1.0, received=101.0) == [(b"third", 100.0)]
+
+
+def test_arrival_of_first_byte():
+    reader = TelegramReader(None)
+    _feed(reader, b"a\r\nb", now=0.0, received=100.0)
+    _feed(reader, b"b", now=1.0, received=101.0)
+    assert _feed(reader, b"b\r\n", now=2.0, received=102.0) == [(b"bbb", 100.0)]
+    _feed(reader, b"c", now=3.0, received=103.0)
+    assert _feed(reader, b"\r\n", now=4.0, received=104.0) == [(b"c", 103.0)]
+
+
+def test_blank_lines_are_skipped():
+    reader = TelegramReader(None)
+    assert _feed(reader, b"\r\n  \r\nx\r\n") == [(b"x", 100.0)]
+    assert reader.frames == 1
+
+
+def test_partial_telegram_discarded_after_gap():
+    reader = TelegramReader(None, gap_timeout=5.0)
+    _feed(reader, b"truncat", now=0.0, received=100.0)
+    assert reader.pending_since == 100.0
+    assert _feed(reader, b"next\r\n", now=10.0, received=110.0) == [(b"next", 110.0)]
+    assert reader.partial == 1
+    assert reader.pending_since is None
+
+
+def test_oversized_run_dropped():
+    reader = TelegramReader(None, max_size=16)
+    assert not _feed(reader, b"x" * 20)
+    assert reader.dropped == 1
+    assert reader.pending_since is None
+    assert _feed(reader, b"ok\r\n") == [(b"ok", 100.0)]
+    assert reader.stats() == {"frames": 1, "partial": 0, "dropped": 1}
+
+
+def test_custom_terminator():
+    reader = TelegramReader(None, terminator=b"\x03")
+    assert _feed(reader, b"\x02one\x03\x02two\x03") == [(b"\x02one", 100.0), (b"\x02two", 100.0)]
+
+
+def test_read_from_port():
+    class Port:
+        in_waiting = 0
+
+        def __init__(self, chunks):
+            self.chunks = list(chunks)
+
+        def read(self, size):
+            assert size >= 1
+            return self.chunks.pop(0) if self.chunks else b""
+
+    reader = TelegramReader(Port([b"ab", b"c\r", b"\nd\r\n"]))
+    frames = [frame for _ in range(3) for frame, _ in reader.read()]
+    assert frames == [b"abc", b"d"]
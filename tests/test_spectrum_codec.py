@@ -0,0 +1,63 @@
+"""Tests of the compact drop spectrum encoding"""
+
+import numpy as np
+import pytest
+
+from spectrum_codec import SHAPE, decode_dataframe, decode_spectrum, encode_spectrum
+
+
+def _spectrum(seed, fill):
+    rng = np.random.default_rng(seed)
+    spectrum = rng.integers(0, 50, SHAPE)
+    spectrum[rng.random(SHAPE) > fill] = 0
+    return spectrum
+
+
+@pytest.mark.parametrize("spectrum", [
+    np.zeros(SHAPE, dtype=int),
+    _spectrum(1, 0.02),
+    _spectrum(2, 1.0),
+    np.full(SHAPE, 99999),
+], ids=["empty", "sparse", "dense", "large"])
+def test_round_trip(spectrum):
+    encoded = encode_spectrum(spectrum)
+    assert encoded.isascii()
+    decoded = decode_spectrum(encoded)
+    assert decoded.dtype == np.int32
+    assert decoded.shape == SHAPE
+    np.testing.assert_array_equal(decoded, spectrum)
+
+
+def test_corner_classes():
+    spectrum = np.zeros(SHAPE, dtype=int)
+    spectrum[0, 0] = 1
+    spectrum[-1, -1] = 300
+    np.testing.assert_array_equal(decode_spectrum(encode_spectrum(spectrum)), spectrum)
+
+
+def test_sparse_spectrum_is_short():
+    assert len(encode_spectrum(_spectrum(3, 0.05))) < 400
+
+
+def test_unsupported_version():
+    encoded = encode_spectrum(np.zeros(SHAPE, dtype=int))
+    with pytest.raises(ValueError):
+        decode_spectrum("AA" + encoded[2:])
+
+
+def test_decode_dataframe():
+    pd = pytest.importorskip("pandas")
+    spectra = [_spectrum(seed, 0.1) for seed in range(3)]
+    times = pd.to_datetime(["2024-05-01T00:00:20", "2024-05-01T00:00:00",
+                            "2024-05-01T00:00:10"], utc=True)
+    df = pd.DataFrame({
+        "timestamp": list(times) + [times[0]],
+        "name": ["parsivel.spectrum"] * 3 + ["parsivel.spectrum.5min"],
+        "value": [encode_spectrum(s) for s in spectra] + [encode_spectrum(spectra[0])],
+    })
+    decoded_times, decoded = decode_dataframe(df)
+    assert decoded_times.dtype == np.dtype("datetime64[ms]")
+    np.testing.assert_array_equal(
+        decoded_times, np.array(["2024-05-01T00:00:00", "2024-05-01T00:00:10",
+                                 "2024-05-01T00:00:20"], dtype="datetime64[ms]"))
+    np.testing.assert_array_equal(decoded, np.stack([spectra[1], spectra[2], spectra[0]]))
@@ -0,0 +1,111 @@
+"""Tests of the background upload queue against a local stand-in for Plugin.upload_file"""
+
+import threading
+
+from conftest import wait_until
+from uploader import SPOOL_SUFFIX, UploadQueue
+
+
+class StandIn:
+    """Records uploads, failing the first ``failures`` attempts"""
+
+    def __init__(self, failures=0, block=None):
+        self.failures = failures
+        self.block = block
+        self.attempts = []
+        self.uploaded = []
+
+    def __call__(self, file_path):
+        self.attempts.append(file_path)
+        if self.block is not None:
+            self.block.wait(5)
+        if len(self.attempts) <= self.failures:
+            raise ConnectionError("beehive unavailable")
+        self.uploaded.append(file_path)
+
+
+def make_file(tmp_path, name):
+    path = tmp_path / name
+    path.write_text("data")
+    return path
+
+
+def spooled(spool):
+    return sorted(spool.glob("*" + SPOOL_SUFFIX))
+
+
+def test_upload_clears_spool(tmp_path):
+    upload = StandIn()
+    uploads = UploadQueue(upload, tmp_path / "spool")
+    path = make_file(tmp_path, "a.csv")
+    uploads.submit(path)
+    assert wait_until(lambda: uploads.uploaded == 1)
+    uploads.close(timeout=5)
+    assert upload.uploaded == [path.resolve()]
+    assert not spooled(tmp_path / "spool")
+    assert uploads.depth == 0
+
+
+def test_failed_uploads_are_retried(tmp_path):
+    upload = StandIn(failures=2)
+    uploads = UploadQueue(upload, tmp_path / "spool", backoff=0.01)
+    uploads.submit(make_file(tmp_path, "a.csv"))
+    assert wait_until(lambda: uploads.uploaded == 1)
+    uploads.close(timeout=5)
+    assert len(upload.attempts) == 3
+    assert uploads.failed == 0
+
+
+def test_gives_up_but_keeps_spool(tmp_path):
+    upload = StandIn(failures=100)
+    uploads = UploadQueue(upload, tmp_path / "spool", max_attempts=3, backoff=0.01)
+    uploads.submit(make_file(tmp_path, "a.csv"))
+    assert wait_until(lambda: uploads.failed == 1)
+    uploads.close(timeout=5)
+    assert len(upload.attempts) == 3
+    # Left for the next restart
+    assert len(spooled(tmp_path / "spool")) == 1
+
+
+def test_spool_is_resubmitted_after_restart(tmp_path):
+    block = threading.Event()
+    first = UploadQueue(StandIn(failures=100, block=block), tmp_path / "spool",
+                        backoff=0.01)
+    path = make_file(tmp_path, "a.csv")
+    first.submit(path)
+    first.close(timeout=0)
+    block.set()
+    assert len(spooled(tmp_path / "spool")) == 1
+
+    upload = StandIn()
+    second = UploadQueue(upload, tmp_path / "spool")
+    assert wait_until(lambda: second.uploaded == 1)
+    second.close(timeout=5)
+    assert upload.uploaded == [path.resolve()]
+    assert not spooled(tmp_path / "spool")
+
+
+def test_full_queue_does_not_block_submit(tmp_path):
+    block = threading.Event()
+    upload = StandIn(block=block)
+    uploads = UploadQueue(upload, tmp_path / "spool", maxsize=1)
+    paths = [make_file(tmp_path, f"{i}.csv") for i in range(3)]
+    for path in paths:
+        uploads.submit(path)
+    # Everything is spooled even though only one upload fits in the queue
+    assert uploads.depth == 3
+    block.set()
+    assert wait_until(lambda: uploads.uploaded == 3, timeout=10)
+    uploads.close(timeout=5)
+    assert sorted(upload.uploaded) == sorted(path.resolve() for path in paths)
+
+
+def test_vanished_file_is_skipped(tmp_path):
+    upload = StandIn()
+    uploads = UploadQueue(upload, tmp_path / "spool")
+    path = make_file(tmp_path, "a.csv")
+    path.unlink()
+    uploads.submit(path)
+    assert wait_until(lambda: not spooled(tmp_path / "spool"))
+    uploads.close(timeout=5)
+    assert not upload.attempts
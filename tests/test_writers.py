@@ -0,0 +1,92 @@
+"""Tests of completing the output files left behind by a crash"""
+
+import numpy as np
+import pytest
+
+from qc import QualityControl, qc_fields
+from simulator import Simulator
+from telegram import compile_decoder, define_telegram, telegram_codes
+from writers import open_writer, read_csv, recover_files
+
+netCDF4 = pytest.importorskip("netCDF4")
+
+
+def write_records(path, output, qc=None, crash=False):
+    """Write simulated telegrams and an undecodable one, then close or crash"""
+    telegram, telegram_units, _, _ = define_telegram("atmos", None)
+    codes = telegram_codes(telegram)
+    extra = qc_fields(codes) if qc is not None else ()
+    decoder = compile_decoder(tuple(codes), tuple(extra))
+    writer = open_writer(output, path, telegram, telegram_units, decoder, journal_records=2)
+    simulator = Simulator(codes, seed=3, rain_onset=1.0)
+    for i in range(5):
+        line = simulator.telegram().decode("ascii").strip()
+        record = decoder.decode(line, timestamp=np.datetime64(i * 60, "s"))
+        if qc is not None:
+            qc.apply(record)
+        writer.write(record, line)
+        if i == 2:
+            writer.write_raw(np.datetime64(150, "s"), "450994;garbled")
+    if crash:
+        # Leave the journal on disk, as a killed process would
+        journal = getattr(writer, "_journal", writer)
+        journal._sync()  # pylint: disable=protected-access
+        journal._file.close()  # pylint: disable=protected-access
+    else:
+        writer.close()
+
+
+def variables(path):
+    with netCDF4.Dataset(path) as dset:
+        return {name: var[:] for name, var in dset.variables.items()}
+
+
+@pytest.mark.parametrize("qc", [None, QualityControl()], ids=["plain", "qc"])
+def test_recovered_netcdf_matches_closed(tmp_path, qc):
+    closed = tmp_path / "closed"
+    crashed = tmp_path / "crashed"
+    closed.mkdir()
+    crashed.mkdir()
+    name = "atmos.parsivel2.19700101.000000.nc"
+    write_records(closed / name, "netcdf", qc)
+    write_records(crashed / name, "netcdf", qc, crash=True)
+    assert (crashed / (name + ".part")).exists()
+
+    assert recover_files(crashed, qc) == [crashed / name]
+    assert not (crashed / (name + ".part")).exists()
+    expected, recovered = variables(closed / name), variables(crashed / name)
+    assert sorted(recovered) == sorted(expected)
+    for key, values in expected.items():
+        np.testing.assert_array_equal(recovered[key], values)
+    assert list(recovered["unparsed_telegram"]) == ["450994;garbled"]
+    if qc is not None:
+        assert recovered["spectrum_qc"].sum() > 0
+
+
+def test_recovered_csv_keeps_journal(tmp_path):
+    name = "atmos.parsivel2.19700101.000000.csv"
+    write_records(tmp_path / name, "csv", crash=True)
+    assert recover_files(tmp_path) == [tmp_path / name]
+    unparsed = []
+    records = read_csv(tmp_path / name, unparsed=unparsed)
+    assert len(records) == 5
+    assert unparsed == [(np.datetime64(150, "s"), "450994;garbled")]
+
+
+def test_truncated_row_is_skipped(tmp_path):
+    name = "atmos.parsivel2.19700101.000000.nc"
+    write_records(tmp_path / name, "netcdf", crash=True)
+    with open(tmp_path / (name + ".part"), "a", encoding="ascii") as part:
+        part.write("1970-01-01T00:0")
+    recover_files(tmp_path)
+    assert len(variables(tmp_path / name)["time"]) == 5
+
+
+def test_only_plugin_temporaries_removed(tmp_path):
+    names = ["notes.tmp", "model.part",
+             "atmos.parsivel2.19700101.000000.nc.tmp",
+             "atmos.parsivel2.19700101.000000.csv.gz.tmp"]
+    for name in names:
+        (tmp_path / name).write_text("x")
+    assert not recover_files(tmp_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["model.part", "notes.tmp"]
@@ -0,0 +1,176 @@
+"""
+This module uploads closed output files to Beehive in the background
+
+Files are handed to an ``UploadQueue`` as soon as they are rotated. Each
+pending upload is recorded as a small marker file in a spool directory
+before it is queued, so uploads that have not completed survive a plugin
+restart and are resubmitted on startup. A bounded queue feeds a pool of
+worker threads which retry failed uploads with exponential backoff; when the
+queue is full, files simply stay in the spool until a worker frees up, so the
+acquisition loop never blocks on the network.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from pathlib import Path
+
+from metrics import Histogram
+
+SPOOL_SUFFIX = ".upload"
+
+
+class UploadQueue:
+    """
+    Background uploader backed by an on-disk spool
+
+    Parameters
+    ----------
+    upload_func : callable
+        Function called with the file path to upload, e.g. a wrapper around
+        ``Plugin.upload_file``. Any exception it raises is treated as a
+        failed attempt and retried.
+    spool_dir : str or pathlib.Path
+        Directory used to persist pending uploads across restarts
+    workers : int
+        Number of upload worker threads
+    maxsize : int
+        Maximum number of uploads held in memory at once
+    max_attempts : int
+        Attempts per file before giving up until the next restart
+    backoff : float
+        Initial retry delay in seconds, doubled after every failure
+    max_backoff : float
+        Upper bound on the retry delay in seconds
+    """
+
+    def __init__(self, upload_func, spool_dir, workers=1, maxsize=16,
+                 max_attempts=8, backoff=2.0, max_backoff=300.0):
+        self.upload_func = upload_func
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.uploaded = 0
+        self.failed = 0
+        self.latency = Histogram()
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pending = set()
+        self._abandoned = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._workers = [threading.Thread(target=self._run,
+                                          name=f"uploader-{i}",
+                                          daemon=True)
+                         for i in range(workers)]
+        # Resubmit anything left over from a previous run
+        self._refill()
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def depth(self):
+        """Number of files waiting to be uploaded, including spooled ones"""
+        return sum(1 for _ in self.spool_dir.glob("*" + SPOOL_SUFFIX))
+
+    def submit(self, file_path):
+        """
+        Schedule a file for upload without blocking
+
+        Parameters
+        ----------
+        file_path : str or pathlib.Path
+            Closed output file to upload
+        """
+        file_path = Path(file_path).resolve()
+        marker = self._marker(file_path)
+        tmp = marker.with_suffix(".tmp")
+        tmp.write_text(str(file_path), encoding="utf-8")
+        os.replace(tmp, marker)
+        self._enqueue(file_path)
+
+    def is_pending(self, file_path):
+        """Whether a file is already spooled for upload"""
+        return self._marker(Path(file_path).resolve()).exists()
+
+    def close(self, timeout=None):
+        """
+        Stop the workers; pending uploads remain in the spool
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait for each worker to finish its current upload
+        """
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _marker(self, file_path):
+        return self.spool_dir / (Path(file_path).name + SPOOL_SUFFIX)
+
+    def _enqueue(self, file_path):
+        with self._lock:
+            if file_path in self._pending or file_path in self._abandoned:
+                return
+            try:
+                self._queue.put_nowait(file_path)
+            except queue.Full:
+                # Leave it in the spool; picked up once the queue drains
+                return
+            self._pending.add(file_path)
+
+    def _refill(self):
+        """Queue spooled uploads that are not already in flight"""
+        for marker in sorted(self.spool_dir.glob("*" + SPOOL_SUFFIX)):
+            try:
+                file_path = Path(marker.read_text(encoding="utf-8").strip())
+            except FileNotFoundError:
+                # Completed by another worker while scanning
+                continue
+            self._enqueue(file_path)
+            if self._queue.full():
+                break
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                file_path = self._queue.get(timeout=1)
+            except queue.Empty:
+                self._refill()
+                continue
+            try:
+                self._upload(file_path)
+            finally:
+                with self._lock:
+                    self._pending.discard(file_path)
+                self._queue.task_done()
+
+    def _upload(self, file_path):
+        marker = self._marker(file_path)
+        delay = self.backoff
+        for attempt in range(1, self.max_attempts + 1):
+            if not file_path.exists():
+                print(f"Upload skipped, {file_path} no longer exists")
+                marker.unlink(missing_ok=True)
+                return
+            start = time.perf_counter()
+            try:
+                self.upload_func(file_path)
+            except Exception as err:  # pylint: disable=broad-except
+                print(f"Upload attempt {attempt} of {file_path} failed: {err}")
+                if self._stop.wait(delay):
+                    return
+                delay = min(delay * 2, self.max_backoff)
+            else:
+                self.latency.observe(time.perf_counter() - start)
+                self.uploaded += 1
+                marker.unlink(missing_ok=True)
+                return
+        self.failed += 1
+        with self._lock:
+            self._abandoned.add(file_path)
+        print(f"Giving up on {file_path} until the next restart")
@@ -0,0 +1,481 @@
+"""
+This module writes decoded Parsivel2 records to local output files
+
+Two formats are supported:
+
+csv
+    The original ';'-delimited text files, one telegram per row, preceded by
+    the telegram description and unit header rows.
+netcdf
+    Columnar NetCDF4 files with one typed variable per field along
+    ``time``: strings are fixed-width characters and the %93 raw spectrum is
+    a compressed int16 (time x diameter x velocity) cube. The file is written in one pass
+    per rotation interval when it is closed. HDF5 adds roughly 20 kB to
+    every file, so at the default 5 minute rotation a file is about the size
+    of the CSV one (and several times larger once gzipped), while hourly
+    files are about 7x smaller.
+
+Telegrams that cannot be decoded are still kept as received, as a row of
+the CSV file or as text in the NetCDF file.
+
+Files are written under a temporary ``.part`` name and only renamed to
+their final name once complete, so a file with its final name is always
+whole. Records are buffered in memory and appended to the ``.part`` file
+(CSV text for both formats, acting as a journal for NetCDF) every
+``journal_records`` records, bounding both the data lost in a crash and the
+number of small writes to the node's flash storage. ``recover_files`` turns
+the ``.part`` files left by a crash into complete files on startup, and
+``compress_file`` optionally compresses closed files before upload, and
+``read_csv`` decodes CSV files and journals back into records.
+"""
+
+import csv
+import gzip
+import os
+import shutil
+
+from pathlib import Path
+
+import numpy as np
+
+from qc import qc_fields
+from telegram import TelegramError, compile_decoder, telegram_codes
+
+FORMATS = {"csv": "csv", "netcdf": "nc"}
+# Compression applied to closed files before upload -> file suffix
+COMPRESSION = {"gzip": ".gz", "zstd": ".zst"}
+PART_SUFFIX = ".part"
+# Smaller NetCDF variables are stored uncompressed, chunking costs more
+MIN_COMPRESSED_BYTES = 4096
+
+
+class CSVWriter:
+    """
+    Write telegrams to a ';'-delimited text file
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Location of the output file
+    telegram : list (str)
+        Parameter descriptions for the instrument configuration
+    telegram_units : list (str)
+        Parameter units for the instrument configuration
+    decoder : telegram.TelegramDecoder, optional
+        Decoder for the instrument telegram, required with ``fields``
+    fields : list (str), optional
+        Record fields to keep, all telegram columns by default
+    journal_records : int
+        Number of rows buffered in memory before they are written to disk
+    """
+
+    def __init__(self, path, telegram, telegram_units, decoder=None, fields=None,
+                 journal_records=5):
+        self.name = str(path)
+        self._part = self.name + PART_SUFFIX
+        self.journal_records = max(1, journal_records)
+        self._rows = []
+        # Telegram columns to keep, a field may span several columns
+        self._columns = None
+        if fields is not None:
+            keep = set(fields)
+            self._columns, header = [], [0]
+            start = 0
+            for i, name in enumerate(decoder.names):
+                count = int(np.prod(decoder.dtype[name].shape))
+                if name in keep:
+                    self._columns.extend(range(start, start + count))
+                    header.append(i + 1)
+                start += count
+            # Keep the empty column after the trailing ';' of each telegram
+            self._columns.append(start)
+            telegram = [telegram[i] for i in header]
+            telegram_units = [telegram_units[i] for i in header]
+        self._file = open(self._part, mode='w', encoding="ascii", newline='')
+        self._writer = csv.writer(self._file, delimiter=';')
+        # Write the file header information
+        self._rows.append(telegram)
+        self._rows.append(telegram_units)
+        self._sync()
+
+    def write(self, record, line):
+        """Append a record, using its original telegram text"""
+        data_out = [str(record["time"].astype("datetime64[ms]"))]
+        values = line.split(';')
+        if self._columns is not None:
+            values = [values[i] for i in self._columns if i < len(values)]
+        data_out.extend(values)
+        self._append(data_out)
+
+    def write_raw(self, timestamp, line):
+        """Append a telegram that could not be decoded, all of its columns as received"""
+        self._append([str(np.datetime64(timestamp, "ms"))] + line.split(';'))
+
+    def _append(self, row):
+        """Buffer a row, writing the buffer out once it is full"""
+        self._rows.append(row)
+        if len(self._rows) >= self.journal_records:
+            self._sync()
+
+    def _sync(self):
+        """Write the buffered rows to the temporary file and on to disk"""
+        self._writer.writerows(self._rows)
+        self._rows.clear()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Write the remaining rows and move the file to its final name"""
+        self._sync()
+        self._file.close()
+        os.replace(self._part, self.name)
+
+    def discard(self):
+        """Close and remove the temporary file"""
+        self._file.close()
+        os.remove(self._part)
+
+
+class NetCDFWriter:
+    """
+    Write decoded records to a compressed, columnar NetCDF4 file
+
+    Records are accumulated in a preallocated structured array for the
+    duration of the rotation interval and written out in one pass on close;
+    until then their telegrams are journaled to a CSV ``.part`` file.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Location of the output file
+    telegram : list (str)
+        Parameter descriptions for the instrument configuration
+    telegram_units : list (str)
+        Parameter units for the instrument configuration
+    decoder : telegram.TelegramDecoder
+        Decoder for the instrument telegram, defines the record layout
+    fields : list (str), optional
+        Record fields to keep, all fields by default
+    journal_records : int
+        Number of records buffered in memory before they are journaled
+    capacity : int
+        Number of records to preallocate space for
+    """
+
+    def __init__(self, path, telegram, telegram_units, decoder, fields=None,
+                 journal_records=5, capacity=512):
+        self.name = str(path)
+        self._journal = CSVWriter(path, telegram, telegram_units, decoder, fields,
+                                  journal_records)
+        self._fields = None
+        self._dtype = decoder.dtype
+        if fields is not None:
+            self._fields = ["time"] + [name for name in fields if name != "time"]
+            self._dtype = np.dtype([(name, decoder.dtype[name]) for name in self._fields])
+        self._records = np.zeros(capacity, dtype=self._dtype)
+        self._count = 0
+        # Arrival time and text of telegrams that could not be decoded
+        self._unparsed = []
+        # Field name -> (description, units) for the variable attributes
+        described = [(desc.strip(), unit.strip())
+                     for desc, unit in zip(telegram, telegram_units)
+                     if telegram_codes([desc])]
+        self._attrs = dict(zip(decoder.names, described))
+
+    def write(self, record, line):
+        """Append a decoded record to the in-memory buffer and the journal"""
+        self._journal.write(record, line)
+        if self._count == len(self._records):
+            self._records = np.concatenate(
+                [self._records, np.zeros(len(self._records), dtype=self._dtype)])
+        self._records[self._count] = record if self._fields is None else record[self._fields]
+        self._count += 1
+
+    def write_raw(self, timestamp, line):
+        """Keep a telegram that could not be decoded as text"""
+        self._journal.write_raw(timestamp, line)
+        self._unparsed.append((np.datetime64(timestamp, "ms"), line))
+
+    def close(self):
+        """Write the buffered records to disk and drop the journal"""
+        tmp = self.name + ".tmp"
+        write_netcdf(tmp, self._records[:self._count], self._attrs,
+                     unparsed=self._unparsed)
+        os.replace(tmp, self.name)
+        self._journal.discard()
+
+
+def open_writer(output, path, telegram, telegram_units, decoder, fields=None,
+                journal_records=5):
+    """
+    Open a writer for the requested output format
+
+    Parameters
+    ----------
+    output : str
+        Output file format, one of ``FORMATS``
+    path : pathlib.Path
+        Location of the output file
+    telegram : list (str)
+        Parameter descriptions for the instrument configuration
+    telegram_units : list (str)
+        Parameter units for the instrument configuration
+    decoder : telegram.TelegramDecoder
+        Decoder for the instrument telegram
+    fields : list (str), optional
+        Record fields to keep, e.g. only the scalars in dry weather
+    journal_records : int
+        Number of records buffered in memory before they are written to disk
+    """
+    if output == "csv":
+        return CSVWriter(path, telegram, telegram_units, decoder, fields, journal_records)
+    if output == "netcdf":
+        return NetCDFWriter(path, telegram, telegram_units, decoder, fields,
+                            journal_records)
+    raise ValueError(f"Unsupported output format: {output}")
+
+
+def write_netcdf(path, records, attrs=None, unparsed=None):
+    """
+    Write an array of decoded records to a NetCDF4 file
+
+    Every HDF5 variable carries a fixed cost of a few hundred bytes, and a
+    few kB more once it is chunked, which outweighs the data of a plugin file
+    holding a handful of records. The ``time`` dimension is therefore fixed
+    so that variables can be stored contiguously, strings are stored as
+    fixed-width characters and only variables large enough to gain from it
+    are chunked and compressed.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Location of the output file
+    records : numpy.ndarray
+        Structured array of records produced by ``TelegramDecoder``
+    attrs : dict, optional
+        Field name -> (description, units) used for variable attributes
+    unparsed : list (tuple), optional
+        (time, telegram) of telegrams that could not be decoded, stored as
+        text in ``unparsed_time`` and ``unparsed_telegram``
+    """
+    # netCDF4 is only required when writing NetCDF output
+    import netCDF4
+
+    attrs = attrs or {}
+    with netCDF4.Dataset(path, mode="w", format="NETCDF4") as dset:
+        # A zero length dimension would be unlimited, forcing chunked storage
+        dset.createDimension("time", len(records) or None)
+        dset.createDimension("diameter", 32)
+        dset.createDimension("velocity", 32)
+        dset.source = "OTT Parsivel2"
+
+        times = dset.createVariable("time", "i8", ("time",))
+        times.units = "milliseconds since 1970-01-01 00:00:00"
+        times.calendar = "standard"
+        times[:] = records["time"].astype("datetime64[ms]").astype("i8")
+
+        for name in records.dtype.names:
+            if name == "time":
+                continue
+            field = records.dtype.fields[name][0]
+            shape = field.shape
+            base = field.base
+            if len(shape) == 2:
+                dims = ("time", "diameter", "velocity")
+            elif len(shape) == 1:
+                dims = ("time", "diameter")
+            else:
+                dims = ("time",)
+            if base.kind == "U":
+                # Fixed-width characters rather than variable-length strings
+                width = base.itemsize // 4
+                if f"strlen{width}" not in dset.dimensions:
+                    dset.createDimension(f"strlen{width}", width)
+                var = dset.createVariable(name, "S1", dims + (f"strlen{width}",))
+                var._Encoding = "ascii"  # pylint: disable=protected-access
+                var[:] = records[name].astype(f"S{width}")
+            elif records[name].nbytes > MIN_COMPRESSED_BYTES:
+                var = dset.createVariable(name, base, dims, zlib=True,
+                                          complevel=4, shuffle=True,
+                                          chunksizes=(max(len(records), 1),) + shape)
+                var[:] = records[name]
+            else:
+                var = dset.createVariable(name, base, dims)
+                var[:] = records[name]
+            if name in attrs:
+                var.long_name, var.units = attrs[name]
+
+        if unparsed:
+            times, lines = zip(*unparsed)
+            width = max(len(line) for line in lines)
+            dset.createDimension("unparsed", len(lines))
+            dset.createDimension("telegram_length", width)
+            var = dset.createVariable("unparsed_time", "i8", ("unparsed",))
+            var.units = "milliseconds since 1970-01-01 00:00:00"
+            var.long_name = "Arrival time of telegrams that could not be decoded"
+            var[:] = np.array(times, dtype="datetime64[ms]").astype("i8")
+            var = dset.createVariable("unparsed_telegram", "S1", ("unparsed", "telegram_length"))
+            var._Encoding = "ascii"  # pylint: disable=protected-access
+            var.long_name = "Telegrams that could not be decoded, as received"
+            var[:] = np.array(lines, dtype=f"S{width}")
+
+
+def compress_file(path, method):
+    """
+    Compress a closed file, replacing it with the compressed copy
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        File to compress
+    method : str
+        One of ``COMPRESSION``
+
+    Output
+    ------
+    compressed : pathlib.Path
+        Location of the compressed file
+    """
+    path = Path(path)
+    compressed = path.with_name(path.name + COMPRESSION[method])
+    tmp = compressed.with_name(compressed.name + ".tmp")
+    with open(path, "rb") as source:
+        if method == "gzip":
+            with gzip.open(tmp, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target)
+        else:
+            # zstandard is only required for zstd compression
+            import zstandard
+            with open(tmp, "wb") as target:
+                zstandard.ZstdCompressor(level=3).copy_stream(source, target)
+    os.replace(tmp, compressed)
+    path.unlink()
+    return compressed
+
+
+def open_text(path):
+    """Open a plugin CSV file for reading, compressed (.gz, .zst) or not"""
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="ascii", errors="replace", newline="")
+    if path.endswith(".zst"):
+        # zstandard is only required for zstd compressed files
+        import zstandard
+        return zstandard.open(path, "rt", encoding="ascii", errors="replace", newline="")
+    return open(path, encoding="ascii", errors="replace", newline="")
+
+
+def read_header(path):
+    """
+    Read the telegram and unit header rows of a plugin CSV file
+
+    Output
+    ------
+    telegram : list (str)
+        Parameter descriptions for the instrument configuration
+    telegram_units : list (str)
+        Parameter units for the instrument configuration
+    """
+    with open_text(path) as nfile:
+        telegram = nfile.readline().rstrip("\r\n").split(";")
+        telegram_units = nfile.readline().rstrip("\r\n").split(";")
+    return telegram, telegram_units
+
+
+def read_csv(path, qc=None, unparsed=None):
+    """
+    Decode a plugin CSV file into an array of records
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        CSV file written by the plugin, optionally gzip or zstd compressed
+    qc : qc.QualityControl, optional
+        Quality control applied to the records, adding the ``qc_fields``
+    unparsed : list, optional
+        Receives (time, telegram) of the rows that cannot be decoded
+
+    Output
+    ------
+    records : numpy.ndarray
+        Structured array with the layout of ``TelegramDecoder(telegram).dtype``
+    """
+    telegram, _ = read_header(path)
+    codes = telegram_codes(telegram)
+    extra = qc_fields(codes) if qc is not None else ()
+    decoder = compile_decoder(tuple(codes), tuple(extra))
+    with open_text(path) as nfile:
+        lines = nfile.read().splitlines()[2:]
+    records = decoder.empty(len(lines))
+    count = 0
+    for line in lines:
+        timestamp, _, telegram_line = line.partition(";")
+        try:
+            timestamp = np.datetime64(timestamp, "ms")
+        except ValueError:
+            # Row cut short by a crash
+            continue
+        try:
+            decoder.decode(telegram_line, timestamp=timestamp,
+                           out=records[count:count + 1])
+        except (TelegramError, ValueError):
+            if unparsed is not None:
+                unparsed.append((timestamp, telegram_line))
+            continue
+        count += 1
+    records = records[:count]
+    if qc is not None:
+        qc.apply(records)
+    return records
+
+
+def field_attrs(path):
+    """Field name -> (description, units) from a file's header rows"""
+    telegram, telegram_units = read_header(path)
+    decoder = compile_decoder(tuple(telegram_codes(telegram)))
+    described = [(desc.strip(), unit.strip())
+                 for desc, unit in zip(telegram, telegram_units)
+                 if telegram_codes([desc])]
+    return dict(zip(decoder.names, described))
+
+
+def recover_files(outdir, qc=None):
+    """
+    Complete the output files left behind by a crash
+
+    CSV ``.part`` files are renamed to their final name; NetCDF journals are
+    decoded and written out as NetCDF, keeping the telegrams that cannot be
+    decoded as text. Temporary files of interrupted NetCDF writes or
+    compressions are removed.
+
+    Parameters
+    ----------
+    outdir : str or pathlib.Path
+        Directory the output files are written to
+    qc : qc.QualityControl, optional
+        Quality control the plugin applies, recomputed for NetCDF journals
+
+    Output
+    ------
+    recovered : list (pathlib.Path)
+        Files completed from their temporary copies
+    """
+    outdir = Path(outdir)
+    # Only the plugin's own files, --outdir may be shared with other data
+    for tmp in outdir.glob("*.parsivel2.*.tmp"):
+        tmp.unlink()
+    recovered = []
+    for part in sorted(outdir.glob("*.parsivel2.*" + PART_SUFFIX)):
+        final = part.with_name(part.name[:-len(PART_SUFFIX)])
+        if final.suffix == "." + FORMATS["netcdf"]:
+            tmp = final.with_name(final.name + ".tmp")
+            unparsed = []
+            write_netcdf(tmp, read_csv(part, qc, unparsed), field_attrs(part),
+                         unparsed=unparsed)
+            os.replace(tmp, final)
+            part.unlink()
+        else:
+            os.replace(part, final)
+        print(f"Recovered {final}")
+        recovered.append(final)
+    return recovered